@@ -0,0 +1,72 @@
+import threading
+import time
+
+import ccxt
+import numpy as np
+
+
+class FakeExchange(ccxt.Exchange):
+
+    def __init__(self, candles: int = 100000, timeframe: str = '1m', page_size: int = 1000, latency: float = 0.0,
+                 jitter: float = 0.0, rate_limit_every: int = 0, gaps: list = None, end: int = None,
+                 config: dict = None):
+        """
+        A local ccxt exchange serving deterministic candles, used to benchmark OhlcvPlus without any network access.
+        Like a real exchange, the series ends with the candle in progress at construction time, which is served but
+        never closed, so downloads up to now are bounded and return every closed candle.
+        :param candles: the number of closed candles of each market.
+        :param timeframe: the timeframe of the candles, other timeframes are served at their own spacing.
+        :param page_size: the maximum number of candles returned by a request.
+        :param latency: the simulated latency of a request in seconds.
+        :param jitter: the maximum random latency added to each request in seconds.
+        :param rate_limit_every: raise ccxt.RateLimitExceeded on every n-th request, 0 to disable.
+        :param gaps: a list of (index, count) tuples, the candles from 'index' to 'index + count' are never served.
+        :param end: a timestamp in milliseconds within the candle in progress, now if None. Exchanges created with the
+        same end serve the same candles.
+        :param config: the ccxt config of the exchange.
+        """
+        super().__init__(config or {})
+        self.id = 'fake'
+        self.name = 'Fake'
+        self.rateLimit = 1
+        self.candles = candles
+        self.tf = self.parse_timeframe(timeframe) * 1000
+        self.end = (int(time.time() * 1000) if end is None else end) // self.tf * self.tf
+        self.start = self.end - candles * self.tf
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.gaps = [(self.start + i * self.tf, self.start + (i + count) * self.tf) for i, count in (gaps or [])]
+        self.calls = 0
+        self.random = np.random.default_rng(0)
+        self.lock = threading.Lock()
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            raise ccxt.RateLimitExceeded('fake rate limit')
+
+        tf = self.parse_timeframe(timeframe) * 1000
+        since = self.start if since is None else max(since, self.start)
+        first = -(-since // tf) * tf
+        # The candle starting at self.end is the one in progress
+        n = min(self.page_size, limit or self.page_size, max(0, (self.end - first) // tf + 1))
+        ts = first + np.arange(n, dtype=np.int64) * tf
+        for start, end in self.gaps:
+            ts = ts[(ts < start) | (ts >= end)]
+
+        # Deterministic prices: a slow wave plus a hashed noise
+        i = ts // tf
+        noise = ((i * 2654435761) % 1000) / 1000
+        close = 100 + 10 * np.sin(i / 1000) + noise
+        open_ = close - noise / 2
+        high = np.maximum(open_, close) + 0.5
+        low = np.minimum(open_, close) - 0.5
+        volume = 10 + noise * 5
+        return np.column_stack([ts.astype(np.float64), open_, high, low, close, volume]).tolist()
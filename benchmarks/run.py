@@ -0,0 +1,180 @@
+"""
+Offline benchmarks of OhlcvPlus against a simulated exchange.
+
+Usage: python -m benchmarks.run [--sizes 10000 1000000 10000000] [--output results.json]
+
+Each benchmark runs in its own process so the peak RSS is measured per benchmark, the database it reads is built
+beforehand by another process. Results are printed or written as JSON so two versions can be compared.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS = ['download', 'update', 'load_cold', 'load_warm', 'save']
+# The benchmarks reading a database built by _setup
+SETUP = ['update', 'load_cold', 'load_warm']
+
+
+def _peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    return rss / 1024 if sys.platform != 'darwin' else rss / 1024 / 1024
+
+
+def _instance(exchange, database_path, **kwargs):
+    from ohlcv import OhlcvPlus
+
+    latencies = []
+
+    class TimedOhlcvPlus(OhlcvPlus):
+        def _fetch_ohlcv(self, request):
+            t = time.perf_counter()
+            try:
+                return super()._fetch_ohlcv(request)
+            finally:
+                latencies.append(time.perf_counter() - t)
+
+    return TimedOhlcvPlus(exchange, database_path, **kwargs), latencies
+
+
+def _exchange(size, options):
+    from benchmarks.fake_exchange import FakeExchange
+
+    # Every process of a benchmark serves the same candles
+    return FakeExchange(candles=size, page_size=options['page_size'], latency=options['latency'],
+                        jitter=options['jitter'], rate_limit_every=options['rate_limit_every'],
+                        gaps=[(size // 2, options['gap'])] if options['gap'] else None, end=options['end'])
+
+
+def _setup(name, size, options, path):
+    """
+    Build the database read by a benchmark, see SETUP.
+    """
+    from ohlcv.utils import timestamp_to_date
+
+    exchange = _exchange(size, options)
+    since = timestamp_to_date(exchange.start)
+    if name == 'update':
+        # The stored series misses its last 10%, only the tail is downloaded
+        o, _ = _instance(exchange, path)
+        o.load('BENCH/USDT', '1m', since, size - size // 10, verbose=False, workers=options['workers'])
+    else:
+        o, _ = _instance(exchange, path, storage=options['storage'])
+        o.load('BENCH/USDT', '1m', since, -1, verbose=False, workers=options['workers'])
+    o.close()
+
+
+def _run(name, size, options, path, queue):
+    from ohlcv.utils import timestamp_to_date
+
+    exchange = _exchange(size, options)
+    since = timestamp_to_date(exchange.start)
+    workers = options['workers']
+    latencies = []
+    candles = size
+    if name == 'download':
+        o, latencies = _instance(exchange, None)
+        t = time.perf_counter()
+        candles = len(o.download('BENCH/USDT', '1m', since, -1, verbose=False, workers=workers))
+    elif name == 'update':
+        o, latencies = _instance(exchange, path)
+        t = time.perf_counter()
+        candles = o.refresh('BENCH/USDT', '1m', since, verbose=False, workers=workers)
+    elif name in ('load_cold', 'load_warm'):
+        o, requests = _instance(exchange, path, storage=options['storage'], cache_size=2 ** 34)
+        if name == 'load_warm':
+            o.load('BENCH/USDT', '1m', since, -1, verbose=False)
+        t = time.perf_counter()
+        candles = len(o.load('BENCH/USDT', '1m', since, -1, verbose=False))
+        # A load benchmark only measures the storage, the series is fully stored
+        if requests:
+            raise RuntimeError(f"{name} sent {len(requests)} requests to the exchange.")
+    elif name == 'save':
+        from ohlcv.parsing import page_frame, parse_page
+        exchange.page_size = size
+        df = page_frame(parse_page(exchange.fetch_ohlcv('BENCH/USDT', '1m', exchange.start, size)))
+        o, _ = _instance(exchange, path, storage=options['storage'])
+        t = time.perf_counter()
+        o._save('bench', 'BENCH/USDT', '1m', df, False)
+    else:
+        raise ValueError(f"Unknown benchmark {name}.")
+    seconds = time.perf_counter() - t
+    if o.db is not None:
+        o.close()
+
+    result = {
+        'benchmark': name,
+        'candles': int(candles),
+        'seconds': round(seconds, 6),
+        'candles_per_second': round(candles / seconds, 1) if seconds > 0 else None,
+        'requests': len(latencies),
+        'p50_page_ms': round(float(np.percentile(latencies, 50)) * 1000, 3) if latencies else None,
+        'p99_page_ms': round(float(np.percentile(latencies, 99)) * 1000, 3) if latencies else None,
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+    queue.put(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--storage', default='candles', choices=['candles', 'sqlite', 'numpy'])
+    parser.add_argument('--workers', type=int, default=100)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated latency of a request in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random latency added to a request in seconds")
+    parser.add_argument('--rate-limit-every', type=int, default=0, help="raise a rate limit error every n requests")
+    parser.add_argument('--gap', type=int, default=0, help="number of candles missing in the middle of the series")
+    parser.add_argument('--output', help="path of the JSON results, printed if omitted")
+    args = parser.parse_args(argv)
+    options = {'storage': args.storage, 'workers': args.workers, 'page_size': args.page_size, 'latency': args.latency,
+               'jitter': args.jitter, 'rate_limit_every': args.rate_limit_every, 'gap': args.gap}
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for size in args.sizes:
+        for name in args.benchmarks:
+            queue = context.Queue()
+            run_options = dict(options, end=int(time.time() * 1000))
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.db')
+                targets = [(_run, (name, size, run_options, path, queue))]
+                if name in SETUP:
+                    targets.insert(0, (_setup, (name, size, run_options, path)))
+                for target, target_args in targets:
+                    process = context.Process(target=target, args=target_args)
+                    process.start()
+                    process.join()
+                    if process.exitcode != 0:
+                        raise RuntimeError(f"Benchmark {name} failed with {size} candles.")
+            result = queue.get()
+            print(f"{name:>10} {size:>10} candles {result['seconds']:>10.3f}s {result['peak_rss_mb']:>8.1f}MB",
+                  file=sys.stderr)
+            results.append({'size': size, **result})
+
+    report = {
+        'date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': options,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,37 @@
-from ohlcv.ohlcv import OhlcvPlus
+import importlib
+
+# The public names of the package mapped to their module. Modules are imported on first access so importing the
+# package does not pull pandas, sqlalchemy and numpy before they are needed.
+EXPORTS = {
+    'OhlcvPlus': 'ohlcv.ohlcv',
+    'check_integrity': 'ohlcv.integrity',
+    'IntegrityReport': 'ohlcv.integrity',
+    'Gap': 'ohlcv.integrity',
+    'Storage': 'ohlcv.storage',
+    'SQLiteStorage': 'ohlcv.storage',
+    'NumpyStorage': 'ohlcv.storage',
+    'CandleStorage': 'ohlcv.storage',
+    'RateLimiter': 'ohlcv.ratelimit',
+    'resample': 'ohlcv.derive',
+    'SeriesCache': 'ohlcv.cache',
+    'CachedStorage': 'ohlcv.cache',
+    'Metrics': 'ohlcv.metrics',
+    'ConsoleReporter': 'ohlcv.metrics',
+    'InstrumentedStorage': 'ohlcv.metrics',
+    'Writer': 'ohlcv.writer',
+}
+
+__all__ = list(EXPORTS)
+
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError(f"module 'ohlcv' has no attribute '{name}'")
+    value = getattr(importlib.import_module(EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(EXPORTS))
+
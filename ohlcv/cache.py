@@ -0,0 +1,240 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ohlcv.storage import Storage
+
+
+class SeriesCache:
+
+    def __init__(self, max_bytes: int):
+        """
+        An in-memory LRU cache of ohlcv windows. Each entry holds all the stored candles of a series in a window
+        [start, end), a request is served from any entry of the same series covering its window by slicing it.
+        :param max_bytes: the memory budget of the cache in bytes, the least recently used entries are evicted once it
+        is exceeded.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The number of writes applied to each series, a window read before a write is not cached after it
+        self.versions = {}
+        # The version of the last write of each series which is not committed yet, and the entries it held back
+        self.pending = {}
+        self.held = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _slice(df, start, end, count):
+        ts = df['timestamp'].to_numpy()
+        lo = 0 if start is None else int(np.searchsorted(ts, start))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, end))
+        if count is not None:
+            hi = min(hi, lo + count)
+        return df.iloc[lo:hi].reset_index(drop=True)
+
+    def get(self, signature: str, start: int = None, end: int = None, count: int = None):
+        """
+        Look up a window, see Storage.read for the parameters.
+        :return: the dataframe of the window, or None if no entry covers it.
+        """
+        with self.lock:
+            for key, df in reversed(self.entries.items()):
+                sign, entry_start, entry_end = key
+                if sign != signature:
+                    continue
+                if entry_start is not None and (start is None or start < entry_start):
+                    continue
+                window = self._slice(df, start, end, count)
+                # An entry open on the right holds the whole tail of the series
+                if entry_end is not None and (end is None or end > entry_end) and \
+                        (count is None or len(window) < count):
+                    continue
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return window
+            self.misses += 1
+            return None
+
+    def version(self, signature: str):
+        """
+        :return: the number of writes applied to a series, see put.
+        """
+        with self.lock:
+            return self.versions.get(signature, 0)
+
+    def put(self, signature: str, start: int, end: int, df: pd.DataFrame, version: int = None):
+        """
+        Add the window [start, end) of a series, None bounds mean the window is open on that side.
+        :param version: the version of the series when the window was read, the window is not added if a write was
+        applied since then or if a write is not committed yet. If None, the window is always added.
+        """
+        size = self._sizeof(df)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if version is not None and (self.versions.get(signature, 0) != version or signature in self.pending):
+                return
+            key = (signature, start, end)
+            if key in self.entries:
+                self.size -= self._sizeof(self.entries.pop(key))
+            self.entries[key] = df
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+                self.evictions += 1
+
+    def hold(self, signature: str, df: pd.DataFrame):
+        """
+        Apply a write which is not committed yet to the entries of a series. The entries overlapping the written candles
+        are dropped, the ones open on the right are held back until the write is committed, see release. No window of
+        the series is added until then.
+        :param df: the written candles.
+        :return: the version of the write, given to release.
+        """
+        with self.lock:
+            version = self.versions[signature] = self.versions.get(signature, 0) + 1
+            self.pending[signature] = version
+            if df.empty:
+                return version
+            first, last = int(df['timestamp'].iloc[0]), int(df['timestamp'].iloc[-1])
+            held = self.held.setdefault(signature, {})
+            for key in [k for k in self.entries if k[0] == signature]:
+                _, start, end = key
+                if (start is not None and last < start) or (end is not None and first >= end):
+                    continue
+                entry = self.entries.pop(key)
+                self.size -= self._sizeof(entry)
+                if end is None:
+                    held[key] = entry
+            return version
+
+    def release(self, signature: str, df: pd.DataFrame, version: int):
+        """
+        Apply a committed write, see hold. The held entries open on the right are extended with the written candles,
+        they are added back once every write held on the series is committed. If a write is rolled back, they are added
+        back by the next write of the series.
+        :param df: the written candles.
+        :param version: the version returned by hold.
+        """
+        with self.lock:
+            held = self.held.get(signature, {})
+            if not df.empty:
+                last = int(df['timestamp'].iloc[-1])
+                for key, entry in held.items():
+                    start = key[1]
+                    if start is not None and last < start:
+                        continue
+                    new = df if start is None else df[df['timestamp'] >= start]
+                    entry = pd.concat([entry, new], ignore_index=True)
+                    entry = entry.drop_duplicates(subset=['timestamp'], keep='last').sort_values('timestamp')
+                    held[key] = entry.reset_index(drop=True)
+            if self.pending.get(signature) != version:
+                # A later write of the series is not committed yet
+                return
+            del self.pending[signature]
+            self.versions[signature] += 1
+            for key, entry in self.held.pop(signature, {}).items():
+                if self._sizeof(entry) <= self.max_bytes:
+                    self.entries[key] = entry
+                    self.size += self._sizeof(entry)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self._sizeof(evicted)
+                self.evictions += 1
+
+    def update(self, signature: str, df: pd.DataFrame):
+        """
+        Apply a committed write to the entries of a series. Entries open on the right are extended with the written
+        candles, entries overlapping the written candles are dropped, the others are left untouched.
+        :param df: the written candles.
+        """
+        self.release(signature, df, self.hold(signature, df))
+
+    def invalidate(self, signature: str = None):
+        """
+        Drop the entries of a series, or all the entries if signature is None.
+        """
+        with self.lock:
+            for key in [k for k in self.entries if signature is None or k[0] == signature]:
+                self.size -= self._sizeof(self.entries.pop(key))
+            for key in [k for k in self.held if signature is None or k == signature]:
+                self.held[key].clear()
+
+    @staticmethod
+    def _sizeof(df):
+        return int(df.memory_usage(index=True).sum())
+
+    def stats(self):
+        """
+        :return: a dict with the hits, misses, evictions, number of entries and size in bytes of the cache.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.size}
+
+
+class CachedStorage(Storage):
+
+    def __init__(self, storage: Storage, cache: SeriesCache, after_commit=None):
+        """
+        A storage backend serving reads from a SeriesCache, writes go through to the wrapped backend and update the
+        cache once they are committed.
+        :param storage: the wrapped backend.
+        :param cache: the cache.
+        :param after_commit: a function registering a callback to run once the current write is committed, see
+        ohlcv.writer.Writer.after_commit. If None, the cache is updated by commit.
+        """
+        self.storage = storage
+        self.cache = cache
+        self.pending = []
+        self.after_commit = after_commit if after_commit is not None else self.pending.append
+
+    def exists(self, signature: str):
+        return self.storage.exists(signature)
+
+    def create(self, signature: str):
+        self.storage.create(signature)
+
+    def write(self, signature: str, df):
+        written = self.storage.write(signature, df)
+        # The windows of the write are not served until it is committed, so a rolled back write is never served
+        version = self.cache.hold(signature, df)
+        self.after_commit(functools.partial(self.cache.release, signature, df, version))
+        return written
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        df = self.cache.get(signature, start, end, count)
+        if df is not None:
+            return df
+        version = self.cache.version(signature)
+        df = self.storage.read(signature, start, end, count)
+        if count is not None and len(df) == count:
+            # The window ends with its last candle, the candles following it are unknown
+            end = int(df['timestamp'].iloc[-1]) + 1 if len(df) else start
+        self.cache.put(signature, start, end, df, version)
+        return df
+
+    def bounds(self, signature: str):
+        return self.storage.bounds(signature)
+
+    def clear(self, signature: str):
+        self.storage.clear(signature)
+        self.cache.invalidate(signature)
+        # No window of the series is cached until the clear is committed
+        version = self.cache.hold(signature, pd.DataFrame())
+        self.after_commit(functools.partial(self.cache.release, signature, pd.DataFrame(), version))
+
+    def commit(self):
+        self.storage.commit()
+        updates = self.pending[:]
+        del self.pending[:]
+        for update in updates:
+            update()
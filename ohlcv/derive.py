@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from ohlcv.storage import COLUMNS
+
+# Offset of the candles of each timeframe unit from the unix epoch in milliseconds. Exchanges align minute, hour and
+# day candles on the epoch and week candles on mondays, the epoch was a thursday.
+OFFSETS = {
+    'w': 4 * 24 * 60 * 60 * 1000,
+}
+
+
+def timeframe_to_ms(timeframe: str):
+    """
+    Convert a ccxt timeframe to milliseconds.
+    :param timeframe: the timeframe as a string e.g. '1m'.
+    :return: the timeframe in milliseconds.
+    :raise ValueError: if the timeframe does not have a fixed length e.g. '1M', months can not be derived.
+    """
+    unit = timeframe[-1]
+    amount = int(timeframe[:-1])
+    units = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000, 'w': 7 * 24 * 60 * 60 * 1000}
+    if unit not in units:
+        raise ValueError(f"Timeframe {timeframe} does not have a fixed length.")
+    return amount * units[unit]
+
+
+def timeframe_offset(timeframe: str):
+    """
+    :return: the offset of the candles of a timeframe from the unix epoch in milliseconds.
+    """
+    return OFFSETS.get(timeframe[-1], 0)
+
+
+def bucket_start(timestamp: int, timeframe: str):
+    """
+    :return: the start of the candle of a timeframe containing a timestamp in milliseconds.
+    """
+    tf = timeframe_to_ms(timeframe)
+    offset = timeframe_offset(timeframe)
+    return (timestamp - offset) // tf * tf + offset
+
+
+def resample(df: pd.DataFrame, timeframe: str, source_timeframe: str, partial: bool = False):
+    """
+    Aggregate a sorted ohlcv dataframe to a higher timeframe. Candles are aligned on the exchange boundaries of the
+    target timeframe, the open is the first open, the high the highest high, the low the lowest low, the close the last
+    close and the volume the sum of the volumes of the source candles.
+    :param df: the source dataframe with the following columns: "timestamp", "open", "high", "low", "close", "volume".
+    :param timeframe: the target timeframe as a string e.g. '1h'.
+    :param source_timeframe: the timeframe of the source dataframe as a string e.g. '1m', it must divide the target
+    timeframe.
+    :param partial: whether to keep the first and last candles when they are not fully covered by the source or not.
+    Candles missing source candles in the middle of the series are always kept, exchanges build them the same way.
+
+    :return: a dataframe with the same columns.
+    :raise ValueError: if the source timeframe does not divide the target timeframe.
+    """
+    tf = timeframe_to_ms(timeframe)
+    source_tf = timeframe_to_ms(source_timeframe)
+    if tf % source_tf != 0 or (timeframe_offset(timeframe) - timeframe_offset(source_timeframe)) % source_tf != 0:
+        raise ValueError(f"Timeframe {timeframe} can not be derived from timeframe {source_timeframe}.")
+    ts = df['timestamp'].to_numpy(dtype=np.int64)
+    if len(ts) == 0:
+        return df.iloc[0:0].reset_index(drop=True)
+
+    offset = timeframe_offset(timeframe)
+    buckets = (ts - offset) // tf * tf + offset
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    out = pd.DataFrame({
+        'timestamp': buckets[starts],
+        'open': df['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+        'close': df['close'].to_numpy()[ends],
+        'volume': np.add.reduceat(df['volume'].to_numpy(), starts),
+    }, columns=COLUMNS)
+
+    if not partial:
+        lo = 0 if ts[0] == buckets[0] else 1
+        hi = len(out) if ts[-1] == buckets[-1] + tf - source_tf else len(out) - 1
+        out = out.iloc[lo:max(lo, hi)]
+    return out.reset_index(drop=True)
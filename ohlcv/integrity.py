@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class Gap:
+
+    def __init__(self, start, end, missing):
+        """
+        A hole in an ohlcv series.
+        :param start: the timestamp of the first missing candle in milliseconds.
+        :param end: the timestamp of the last missing candle in milliseconds.
+        :param missing: the number of missing candles.
+        """
+        self.start = start
+        self.end = end
+        self.missing = missing
+
+    def __repr__(self):
+        return f"Gap(start={self.start}, end={self.end}, missing={self.missing})"
+
+
+class IntegrityReport:
+
+    def __init__(self, timeframe, gaps, misaligned, unordered):
+        """
+        The result of an integrity check.
+        :param timeframe: the expected spacing between two candles in milliseconds.
+        :param gaps: a list of Gap objects, sorted by start timestamp.
+        :param misaligned: a numpy array of timestamps that do not fall on the timeframe grid.
+        :param unordered: a numpy array of timestamps that are lower than or equal to their predecessor, this includes
+        duplicates.
+        """
+        self.timeframe = timeframe
+        self.gaps = gaps
+        self.misaligned = misaligned
+        self.unordered = unordered
+
+    @property
+    def missing(self):
+        return sum(gap.missing for gap in self.gaps)
+
+    @property
+    def ok(self):
+        return not self.gaps and len(self.misaligned) == 0 and len(self.unordered) == 0
+
+    def __repr__(self):
+        return f"IntegrityReport(gaps={len(self.gaps)}, missing={self.missing}, " \
+               f"misaligned={len(self.misaligned)}, unordered={len(self.unordered)})"
+
+
+def check_integrity(timestamps, timeframe: int, offset: int = None):
+    """
+    Check an ohlcv series for holes, misaligned and out-of-order candles.
+    :param timestamps: the timestamps of the series in milliseconds, any array-like e.g. df['timestamp'].
+    :param timeframe: the expected spacing between two candles in milliseconds.
+    :param offset: the offset of the timeframe grid in milliseconds. If None, the grid is aligned on the first
+    timestamp of the series.
+
+    :return: an IntegrityReport object.
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    timeframe = int(timeframe)
+    if len(ts) == 0:
+        return IntegrityReport(timeframe, [], ts, ts)
+    if offset is None:
+        offset = int(ts[0]) % timeframe
+
+    unordered = ts[1:][np.diff(ts) <= 0]
+    misaligned = ts[(ts - offset) % timeframe != 0]
+
+    # Gaps are computed on the sorted unique timestamps so that unordered candles are not reported twice
+    s = np.unique(ts)
+    d = np.diff(s)
+    idx = np.flatnonzero(d > timeframe)
+    starts = s[idx] + timeframe
+    ends = s[idx + 1] - timeframe
+    missing = (d[idx] - 1) // timeframe
+    gaps = [Gap(int(a), int(b), int(c)) for a, b, c in zip(starts, ends, missing)]
+    return IntegrityReport(timeframe, gaps, misaligned, unordered)
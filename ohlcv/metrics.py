@@ -0,0 +1,212 @@
+import bisect
+import threading
+import time
+
+from colorama import Fore
+
+from ohlcv.storage import Storage
+from ohlcv.utils import Bar
+
+# Upper bounds of the duration histograms in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    'ohlcv_requests_total': ('counter', "Requests sent to the exchange."),
+    'ohlcv_request_seconds': ('histogram', "Duration of the requests sent to the exchange."),
+    'ohlcv_retries_total': ('counter', "Requests retried, by exception type."),
+    'ohlcv_rate_limit_wait_seconds_total': ('counter', "Time spent waiting for the rate limiter."),
+    'ohlcv_rate_limit_rate': ('gauge', "Current request rate allowed by the rate limiter."),
+    'ohlcv_rows_downloaded_total': ('counter', "Candles downloaded."),
+    'ohlcv_download_rows_per_second': ('gauge', "Throughput of the last download."),
+    'ohlcv_integrity_gaps_total': ('counter', "Gaps detected by the integrity check."),
+    'ohlcv_integrity_missing_total': ('counter', "Candles detected as missing by the integrity check."),
+    'ohlcv_storage_seconds': ('histogram', "Duration of the storage operations."),
+    'ohlcv_storage_rows_total': ('counter', "Candles read from or written to the storage."),
+    'ohlcv_cache_hits_total': ('counter', "Windows served by the cache."),
+    'ohlcv_cache_misses_total': ('counter', "Windows not found in the cache."),
+    'ohlcv_cache_evictions_total': ('counter', "Windows evicted from the cache."),
+    'ohlcv_cache_bytes': ('gauge', "Memory used by the cache."),
+}
+
+
+class Metrics:
+
+    def __init__(self):
+        """
+        A registry of the events of OhlcvPlus instances. Each event updates the counters, gauges and histograms of the
+        registry and is forwarded to the subscribers, e.g. a ConsoleReporter printing the progress or a callback sending
+        the events to a monitoring system. The registry can be exported in the prometheus text format.
+
+        Events and their fields:
+        - 'request': market, timeframe, seconds.
+        - 'retry': exception, the name of the exception type.
+        - 'rate_limit_wait': seconds, rate.
+        - 'download': market, timeframe, rows, seconds.
+        - 'integrity': market, timeframe, gaps, missing.
+        - 'storage': operation ('read', 'write' or 'commit'), rows, seconds.
+        - 'message': text, level ('info' or 'warning'), verbose.
+        - 'progress_start': total, verbose. 'progress': done, rate_limited, rate, verbose. 'progress_end': verbose.
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.subscribers = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """
+        Register a callback called with (event, fields) for every event, fields is a dict.
+        """
+        self.subscribers.append(callback)
+
+    def add_collector(self, collector):
+        """
+        Register a function returning a dict of {metric name: value}, called on every export.
+        """
+        self.collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            buckets, _, _ = histogram = self.histograms[key]
+            buckets[bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def emit(self, event: str, **fields):
+        """
+        Record an event and forward it to the subscribers.
+        """
+        if event == 'request':
+            self.inc('ohlcv_requests_total', timeframe=fields['timeframe'])
+            self.observe('ohlcv_request_seconds', fields['seconds'], timeframe=fields['timeframe'])
+        elif event == 'retry':
+            self.inc('ohlcv_retries_total', exception=fields['exception'])
+        elif event == 'rate_limit_wait':
+            self.inc('ohlcv_rate_limit_wait_seconds_total', fields['seconds'])
+            self.set('ohlcv_rate_limit_rate', fields['rate'])
+        elif event == 'download':
+            self.inc('ohlcv_rows_downloaded_total', fields['rows'], timeframe=fields['timeframe'])
+            if fields['seconds'] > 0:
+                self.set('ohlcv_download_rows_per_second', fields['rows'] / fields['seconds'])
+        elif event == 'integrity':
+            self.inc('ohlcv_integrity_gaps_total', fields['gaps'])
+            self.inc('ohlcv_integrity_missing_total', fields['missing'])
+        elif event == 'storage':
+            self.observe('ohlcv_storage_seconds', fields['seconds'], operation=fields['operation'])
+            self.inc('ohlcv_storage_rows_total', fields['rows'], operation=fields['operation'])
+        for callback in self.subscribers:
+            callback(event, fields)
+
+    def to_prometheus(self):
+        """
+        :return: the registry in the prometheus text exposition format.
+        """
+        def labels(pairs):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: (list(v[0]), v[1], v[2]) for k, v in self.histograms.items()}
+        for collector in self.collectors:
+            for name, value in collector().items():
+                (counters if HELP.get(name, ('gauge',))[0] == 'counter' else gauges)[(name, ())] = value
+
+        lines = []
+        names = sorted({k[0] for k in counters} | {k[0] for k in gauges} | {k[0] for k in histograms})
+        for name in names:
+            kind, description = HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, pairs), value in sorted({**counters, **gauges}.items()):
+                if n == name:
+                    lines.append(f"{name}{labels(pairs)} {value}")
+            for (n, pairs), (buckets, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(list(BUCKETS) + ['+Inf'], buckets):
+                    cumulative += c
+                    lines.append(f"{name}_bucket{labels(pairs + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{labels(pairs)} {total}")
+                lines.append(f"{name}_count{labels(pairs)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class ConsoleReporter:
+
+    def __init__(self):
+        """
+        A Metrics subscriber printing the messages and the progress bar of the verbose mode.
+        """
+        self.bar = None
+
+    def __call__(self, event: str, fields: dict):
+        if not fields.get('verbose'):
+            return
+        if event == 'message':
+            color = Fore.YELLOW if fields.get('level') == 'warning' else Fore.CYAN
+            print(color, fields['text'], Fore.RESET)
+        elif event == 'progress_start':
+            self.bar = Bar(max(1, fields['total']))
+        elif event == 'progress' and self.bar is not None:
+            if 'total' in fields:
+                self.bar.max_value = max(1, fields['total'])
+            front = f"Rate limited, {fields['rate']:.1f} requests/s" if fields.get('rate_limited') else ""
+            self.bar.update(fields['done'], front=front)
+        elif event == 'progress_end' and self.bar is not None:
+            self.bar.finish()
+            self.bar = None
+
+
+class InstrumentedStorage(Storage):
+
+    def __init__(self, storage: Storage, metrics: Metrics):
+        """
+        A storage backend emitting a 'storage' event with the duration of every read and write of the wrapped backend.
+        """
+        self.storage = storage
+        self.metrics = metrics
+
+    def exists(self, signature: str):
+        return self.storage.exists(signature)
+
+    def create(self, signature: str):
+        self.storage.create(signature)
+
+    def write(self, signature: str, df):
+        t = time.perf_counter()
+        written = self.storage.write(signature, df)
+        self.metrics.emit('storage', operation='write', rows=len(df), seconds=time.perf_counter() - t)
+        return written
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        t = time.perf_counter()
+        df = self.storage.read(signature, start, end, count)
+        self.metrics.emit('storage', operation='read', rows=len(df), seconds=time.perf_counter() - t)
+        return df
+
+    def bounds(self, signature: str):
+        return self.storage.bounds(signature)
+
+    def clear(self, signature: str):
+        self.storage.clear(signature)
+
+    def commit(self):
+        t = time.perf_counter()
+        self.storage.commit()
+        self.metrics.emit('storage', operation='commit', rows=0, seconds=time.perf_counter() - t)
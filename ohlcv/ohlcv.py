@@ -1,22 +1,53 @@
+import asyncio
+import contextlib
 import datetime
+import functools
 import math
-import multiprocessing
+import queue
 import threading
 import time
 import sqlalchemy as orm
-from colorama import Fore
+from sqlalchemy.dialects.sqlite import insert
 
-from ohlcv.utils import Bar, date_to_timestamp, timestamp_to_date, generate_sign
-import ccxt
+from ohlcv.cache import SeriesCache, CachedStorage
+from ohlcv.integrity import check_integrity
+from ohlcv.metrics import Metrics, ConsoleReporter, InstrumentedStorage
+from ohlcv.parsing import PageBuffer, parse_page, page_frame
+from ohlcv.ratelimit import RateLimiter, backoff
+from ohlcv.derive import resample, timeframe_to_ms, timeframe_offset, bucket_start
+from ohlcv.storage import DEFAULT_PRAGMAS, apply_pragmas, Storage, SQLiteStorage, NumpyStorage, CandleStorage
+from ohlcv.utils import date_to_timestamp, timestamp_to_date, generate_sign
+from ohlcv.writer import Writer, RoutedConnection, begin_immediate, read_only_engine
+import numpy as np
 import pandas as pd
 
 LIMIT = 1000000
+# Number of retries of a request failing with a network error, rate limit errors included.
+MAX_RETRIES = 8
+# Number of pages written to the storage in a single transaction by a checkpointed download.
+CHECKPOINT_PAGES = 50
 
 
 class NotEnoughDataException(Exception):
     pass
 
 
+def writes(method):
+    """
+    Decorate the methods of OhlcvPlus writing to the database. In concurrent mode they are run by the writer thread and
+    committed with the other pending writes, see ohlcv.writer.Writer. Otherwise they are run under db_lock.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if self.writer is None:
+            with self.db_lock:
+                return method(self, *args)
+        return self.writer.execute(method, self, *args)
+
+    return wrapper
+
+
 class Request:
 
     def __init__(self, market, timeframe, since, limit):
@@ -26,17 +57,91 @@ class Request:
         self.limit = limit
 
 
+class Job:
+
+    def __init__(self, market, timeframe, since, limit):
+        """
+        The state of one series of a load_many call, or of one download of a stored series.
+        """
+        self.market = market
+        self.timeframe = timeframe
+        self.since = since
+        self.limit = limit
+        self.signature = None
+        self.start = date_to_timestamp(since)
+        self.fetch = limit
+        self.stored = False
+        # The series a download of a stored series belongs to, and the (start, end) of the window it covers, see _save.
+        # end is None when the window ends with the last downloaded candle.
+        self.parent = None
+        self.cover = (self.start, None)
+        self.requests = None
+        self.buffer = None
+        self.remaining = 0
+        self.count = None
+        self.tf = None
+        self.max_limit = None
+        self.result = None
+        self.error = None
+
+
 class OhlcvPlus:
 
-    def __init__(self, client: ccxt.Exchange, database_path: str = "ohlcvplus.db"):
+    def __init__(self, client: 'ccxt.Exchange', database_path: str = "ohlcvplus.db", pragmas: dict = None,
+                 storage: (str, Storage) = 'candles', rate_limiter: RateLimiter = None, async_client=None,
+                 cache_size: int = None, float32: bool = False, metrics: Metrics = None, concurrent: bool = False):
         """
         Initialize the main class.
         :param client: an initialized ccxt client e.g. ccxt.binance()
         :param database_path: Persistence is achieved through sqlite3. This parameter is the path to the database
         file. If None, the persistence will be disabled.
+        :param pragmas: the sqlite pragmas applied to every connection as a dict e.g. {'synchronous': 'OFF'}. If None,
+        ohlcv.storage.DEFAULT_PRAGMAS is used (WAL journal, NORMAL synchronous, larger pages and cache). Pass an
+        empty dict to keep the sqlite defaults.
+        :param storage: where the candles are stored, the sqlite database always holds the catalog of the series.
+        'candles' stores every series in a single table of the database clustered by series and timestamp. 'sqlite'
+        stores each series in a table of the database, this is the historical layout. The series of a database written
+        with the historical layout are still read and extended with 'candles'. 'numpy' stores each series as
+        memory-mapped .npy column files in the '<database_path>.columns' directory, this is much faster to load. A
+        Storage instance can also be passed.
+        :param rate_limiter: the rate limiter shared by all the requests of this instance. If None, it is seeded from
+        the rateLimit attribute of the client.
+        :param async_client: the ccxt.async_support client used by the asynchronous methods e.g.
+        ccxt.async_support.binance(). If None, it is created from the id of 'client' on first use.
+        :param cache_size: the memory budget in bytes of an in-memory LRU cache of the loaded windows, e.g. 512 * 2**20.
+        Windows covered by a cached one are served by slicing it and writes update the cache. If None, the cache is
+        disabled. The hit, miss and eviction counters are available with self.cache.stats().
+        :param float32: whether to return the prices and volumes as float32 instead of float64, this halves the memory
+        used by the returned dataframes and by the downloads which are not stored. The stored candles are always
+        downloaded and written as float64, only the returned dataframes are cast.
+        :param metrics: the registry receiving the events of this instance: requests, retries, rate limiter waits,
+        downloads, integrity checks and storage operations, see ohlcv.metrics.Metrics. It can be shared by several
+        instances and exported with metrics.to_prometheus(). If None, a registry printing the verbose output with a
+        ConsoleReporter is created.
+        :param concurrent: whether the database is shared by several threads or processes. Writes are then queued to a
+        single writer thread committing them by batches, each batch in a transaction taking the write lock when it
+        begins, and reads use a pool of read-only connections so they never wait for a write. Use it when several
+        processes use the same database file.
         """
         self.client = client
+        if metrics is None:
+            metrics = Metrics()
+            metrics.subscribe(ConsoleReporter())
+        self.metrics = metrics
+        self.float32 = float32
+        self.async_client = async_client
+        # The (page size, spacing, earliest, listed) metadata of each (market, timeframe) of the exchange, see _probe
+        self.market_info = {}
+        # The connection of the concurrent mode is thread safe
+        self.db_lock = threading.RLock() if not concurrent else contextlib.nullcontext()
+        self.writer = None
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.from_client(client)
         self.db = orm.create_engine(f'sqlite:///{database_path}', echo=False, future=True) if database_path else None
+        pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        if self.db is not None:
+            apply_pragmas(self.db, pragmas)
+            if concurrent:
+                begin_immediate(self.db)
         self.conn = self.db.connect() if self.db else None
         self.metadata = orm.MetaData() if self.db else None
         if self.db is not None:
@@ -47,30 +152,391 @@ class OhlcvPlus:
                                    orm.Column('market', orm.String),
                                    orm.Column('timeframe', orm.String),
                                    orm.Column('since', orm.BigInteger),
-                                   orm.Column('limit', orm.BigInteger))
+                                   orm.Column('limit', orm.BigInteger),
+                                   orm.Column('until', orm.BigInteger))
+            # --- Checkpoints Table ---
+            # The request windows already stored by the checkpointed downloads still in progress
+            self.checkpoints = orm.Table('ohlcv_checkpoints', self.metadata,
+                                         orm.Column('signature', orm.String, primary_key=True),
+                                         orm.Column('since', orm.BigInteger, primary_key=True))
+            # --- Coverage Table ---
+            # The disjoint windows [since, until) covered by each series, see _cover. The series written by earlier
+            # versions have no row, they cover the single window of the main table.
+            self.coverage = orm.Table('ohlcv_coverage', self.metadata,
+                                      orm.Column('signature', orm.String, primary_key=True),
+                                      orm.Column('since', orm.BigInteger, primary_key=True),
+                                      orm.Column('until', orm.BigInteger))
+            # --- Markets Table ---
+            # The page size of the exchange, the spacing between two candles in milliseconds and the earliest known
+            # candle of each market and timeframe, so downloads are scheduled without a first request. listed is true
+            # when no candle exists before the earliest one.
+            self.markets = orm.Table('ohlcv_markets', self.metadata,
+                                     orm.Column('exchange', orm.String, primary_key=True),
+                                     orm.Column('market', orm.String, primary_key=True),
+                                     orm.Column('timeframe', orm.String, primary_key=True),
+                                     orm.Column('page_size', orm.BigInteger),
+                                     orm.Column('spacing', orm.BigInteger),
+                                     orm.Column('earliest', orm.BigInteger),
+                                     orm.Column('listed', orm.Boolean))
             self.metadata.create_all(self.db)
+            # The main table of databases written by earlier versions does not record the end of the covered windows
+            columns = {r[1] for r in self.conn.exec_driver_sql("PRAGMA table_info(ohlcv)").fetchall()}
+            if 'until' not in columns:
+                try:
+                    self.conn.exec_driver_sql('ALTER TABLE ohlcv ADD COLUMN "until" BIGINT')
+                except orm.exc.OperationalError:
+                    # Added by another process in the meantime
+                    self.conn.rollback()
             self.conn.commit()
+            if concurrent:
+                self.conn.close()
+                self.writer = Writer(self.db)
+                self.conn = RoutedConnection(read_only_engine(database_path, pragmas), self.writer)
+
+            # --- Storage ---
+            if storage == 'candles':
+                storage = CandleStorage(self.db, self.conn, self.metadata)
+            elif storage == 'sqlite':
+                storage = SQLiteStorage(self.db, self.conn, self.metadata)
+            elif storage == 'numpy':
+                storage = NumpyStorage(f"{database_path}.columns")
+            storage = InstrumentedStorage(storage, self.metrics)
+            self.cache = SeriesCache(cache_size) if cache_size is not None else None
+            after_commit = self.writer.after_commit if self.writer is not None else None
+            self.storage = CachedStorage(storage, self.cache, after_commit) if self.cache is not None else storage
+            if self.cache is not None:
+                self.metrics.add_collector(self._cache_metrics)
+            self.signatures = {s[0] for s in self.conn.execute(orm.select(self.table.c.signature)).fetchall()}
 
-            # --- Ohlcv Tables ---
-            # Load all existing tables
-            signatures = self.conn.execute(orm.select(self.table.c.signature)).fetchall()
-            self.tables = {signature: orm.Table(signature, self.metadata, autoload_with=self.db)
-                           for signature in [s[0] for s in signatures]}
+    def _cache_metrics(self):
+        """
+        :return: the counters of the cache of this instance, collected by the metrics registry on export.
+        """
+        stats = self.cache.stats()
+        return {'ohlcv_cache_hits_total': stats['hits'], 'ohlcv_cache_misses_total': stats['misses'],
+                'ohlcv_cache_evictions_total': stats['evictions'], 'ohlcv_cache_bytes': stats['bytes']}
+
+    def _message(self, text: str, verbose: bool, level: str = 'info'):
+        """
+        Emit a message event, printed by the ConsoleReporter in verbose mode.
+        """
+        self.metrics.emit('message', text=text, level=level, verbose=verbose)
 
     def _fetch_ohlcv(self, request):
         """
         Fetch OHLCV data from the exchange.
         :param request: a Request object
-        :return: a list of OHLCV data
+        :return: a page of OHLCV data, see ohlcv.parsing.parse_page
+        """
+        return parse_page(self.client.fetch_ohlcv(request.market, request.timeframe, request.since, request.limit))
+
+    def _async_client(self):
+        """
+        :return: the ccxt.async_support client of this instance, created from the id of the synchronous client if it
+        was not given to the constructor.
+        """
+        if self.async_client is None:
+            import ccxt.async_support
+            self.async_client = getattr(ccxt.async_support, self.client.id)({
+                'enableRateLimit': False, 'timeout': self.client.timeout, 'options': dict(self.client.options)})
+        return self.async_client
+
+    async def _afetch_ohlcv(self, request):
+        """
+        Asynchronous version of _fetch_ohlcv.
+        """
+        client = self._async_client()
+        return parse_page(await client.fetch_ohlcv(request.market, request.timeframe, request.since, request.limit))
+
+    def _request(self, request):
+        """
+        Fetch OHLCV data from the exchange through the rate limiter. Network errors are retried with a jittered
+        exponential back-off, rate limit errors also decrease the request rate.
+        :param request: a Request object
+        :return: a page of OHLCV data, see ohlcv.parsing.parse_page
+        :raise Exception: the last network error once MAX_RETRIES is reached, any other exception immediately.
+        """
+        # ccxt is only imported once a request is sent, it takes most of the import time of this package
+        import ccxt
+        attempt = 0
+        while True:
+            wait = self.rate_limiter.acquire()
+            if wait > 0:
+                self.metrics.emit('rate_limit_wait', seconds=wait, rate=self.rate_limiter.rate)
+            try:
+                t = time.perf_counter()
+                df = self._fetch_ohlcv(request)
+                self.metrics.emit('request', market=request.market, timeframe=request.timeframe,
+                                  seconds=time.perf_counter() - t)
+                self.rate_limiter.success(getattr(self.client, 'last_response_headers', None))
+                return df
+            except ccxt.DDoSProtection as e:
+                # RateLimitExceeded is a subclass of DDoSProtection
+                self.rate_limiter.penalize()
+                if attempt >= MAX_RETRIES:
+                    raise
+                self.metrics.emit('retry', exception=type(e).__name__)
+            except ccxt.NetworkError as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                self.metrics.emit('retry', exception=type(e).__name__)
+            attempt += 1
+            time.sleep(backoff(attempt))
+
+    async def _arequest(self, request):
+        """
+        Asynchronous version of _request, the rate limiter is shared with the synchronous requests.
+        """
+        import ccxt
+        attempt = 0
+        while True:
+            wait = await self.rate_limiter.aacquire()
+            if wait > 0:
+                self.metrics.emit('rate_limit_wait', seconds=wait, rate=self.rate_limiter.rate)
+            try:
+                t = time.perf_counter()
+                df = await self._afetch_ohlcv(request)
+                self.metrics.emit('request', market=request.market, timeframe=request.timeframe,
+                                  seconds=time.perf_counter() - t)
+                self.rate_limiter.success(getattr(self._async_client(), 'last_response_headers', None))
+                return df
+            except ccxt.DDoSProtection as e:
+                self.rate_limiter.penalize()
+                if attempt >= MAX_RETRIES:
+                    raise
+                self.metrics.emit('retry', exception=type(e).__name__)
+            except ccxt.NetworkError as e:
+                if attempt >= MAX_RETRIES:
+                    raise
+                self.metrics.emit('retry', exception=type(e).__name__)
+            attempt += 1
+            await asyncio.sleep(backoff(attempt))
+
+    def _gap_requests(self, report, market, timeframe, max_limit, verbose):
+        """
+        Schedule the requests re-fetching the windows reported as missing by an integrity check.
+        :param report: the IntegrityReport of the downloaded dataframe.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param max_limit: the maximum number of candles returned by the exchange in a single request.
+        :param verbose: whether to print the progress or not.
+        :return: a list of (Gap, Request) tuples.
+        """
+        tf = report.timeframe
+        requests = []
+        for gap in report.gaps:
+            for i in range(math.ceil(gap.missing / max_limit)):
+                requests.append((gap, Request(market, timeframe, gap.start + i * max_limit * tf, LIMIT)))
+        self._message(f"Re-fetching {report.missing} missing candles in {len(requests)} requests.", verbose)
+        return requests
+
+    def _merge_gaps(self, df, pages):
+        """
+        Merge the pages re-fetched for the gaps of a dataframe.
+        :param df: the downloaded dataframe.
+        :param pages: a list of (Gap, page) tuples.
+        :return: the dataframe merged with the re-fetched candles, sorted by timestamp.
+        """
+        float32 = df['open'].dtype == np.float32
+        frames = [df] + [page_frame(page[(page[:, 0] >= gap.start) & (page[:, 0] <= gap.end)], float32)
+                         for gap, page in pages]
+        df = pd.concat(frames, ignore_index=True)
+        df = df.drop_duplicates(subset=['timestamp']).sort_values('timestamp')
+        return df.reset_index(drop=True)
+
+    def _market_info(self, market: str, timeframe: str):
+        """
+        :return: the cached (page size, spacing, earliest, listed) metadata of a market and timeframe, None if unknown.
+        """
+        key = (market, timeframe)
+        if key not in self.market_info:
+            row = None
+            if self.db is not None:
+                c = self.markets.c
+                with self.db_lock:
+                    row = self.conn.execute(orm.select(c.page_size, c.spacing, c.earliest, c.listed).where(
+                        c.exchange == self.client.name, c.market == market, c.timeframe == timeframe)).first()
+            self.market_info[key] = tuple(row) if row is not None else None
+        return self.market_info[key]
+
+    def _set_market_info(self, market: str, timeframe: str, info: tuple):
+        """
+        Cache the (page size, spacing, earliest, listed) metadata of a market and timeframe, None to drop it.
+        """
+        self.market_info[(market, timeframe)] = info
+        if self.db is not None:
+            self._store_market_info(market, timeframe, info)
+
+    @writes
+    def _store_market_info(self, market: str, timeframe: str, info: tuple):
+        """
+        Write the metadata of a market and timeframe to the database, see _set_market_info.
+        """
+        c = self.markets.c
+        if info is None:
+            self.conn.execute(self.markets.delete().where(
+                c.exchange == self.client.name, c.market == market, c.timeframe == timeframe))
+        else:
+            values = dict(page_size=info[0], spacing=info[1], earliest=info[2], listed=info[3])
+            self.conn.execute(insert(self.markets).values(
+                exchange=self.client.name, market=market, timeframe=timeframe, **values).on_conflict_do_update(
+                index_elements=['exchange', 'market', 'timeframe'], set_=values))
+        self.conn.commit()
+
+    def _plan(self, market: str, timeframe: str, since: int):
+        """
+        Plan a download from the cached metadata of a market and timeframe, see _probe.
+        :return: a (first, tf, max_limit, None) tuple, or None if the metadata is not cached or does not tell where the
+        download starts.
+        """
+        info = self._market_info(market, timeframe)
+        if info is None:
+            return None
+        max_limit, tf, earliest, listed = info
+        offset = timeframe_offset(timeframe)
+        first = -(-(since - offset) // tf) * tf + offset
+        if first < earliest:
+            # Requests sent before the first candle of the market all return the same page
+            if not listed:
+                return None
+            first = earliest
+        if first + tf > time.time() * 1000:
+            raise NotEnoughDataException("Not enough data available for the requested market and timeframe.")
+        return first, tf, max_limit, None
+
+    def _measure(self, market: str, timeframe: str, since: int, ohlcv: np.ndarray):
+        """
+        Plan a download from the response of its first request and cache the metadata of the market and timeframe,
+        see _probe.
+        :param ohlcv: the page returned by the first request.
+        :return: a (first, tf, max_limit, ohlcv) tuple.
+        """
+        if len(ohlcv) == 0:
+            raise NotEnoughDataException("No data available for the requested market and timeframe.")
+        if len(ohlcv) == 1:
+            raise NotEnoughDataException("Not enough data available for the requested market and timeframe.")
+        max_limit = len(ohlcv)
+        first = int(ohlcv[0, 0])
+        try:
+            tf = timeframe_to_ms(timeframe)
+        except ValueError:
+            # Months do not have a fixed length, they are never cached
+            return first, int(ohlcv[1, 0]) - first, max_limit, ohlcv
+        info = self._market_info(market, timeframe)
+        # A page reaching the current candle is not full, it only bounds the page size of the exchange
+        full = int(ohlcv[-1, 0]) + 2 * tf <= time.time() * 1000
+        if full or info is not None:
+            page_size = max_limit if full else info[0]
+            earliest = first if info is None else min(first, info[2])
+            # More than a page of candles missing before the first one means the market was listed at this candle, a
+            # shorter hole can be a downtime of the exchange
+            listed = earliest == first and first - since >= page_size * tf
+            self._set_market_info(market, timeframe, (page_size, tf, earliest, listed))
+        return first, tf, max_limit, ohlcv
+
+    def _probe(self, market: str, timeframe: str, since: int):
+        """
+        Find the first candle of a download, the spacing between two candles and the page size of the exchange. They
+        are computed from the cached metadata of the market and timeframe when available, no request is sent. Otherwise
+        they are measured with a first request, its response is the first page of the download and the metadata is
+        cached in the database.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param since: the start of the download in milliseconds.
+        :return: a (first, tf, max_limit, page) tuple, first is the timestamp of the first candle, tf the spacing
+        between two candles in milliseconds, max_limit the maximum number of candles returned by the exchange in a
+        single request and page the response of the first request, None if no request was sent.
+        :raise NotEnoughDataException: if no closed candle is available from since.
+        """
+        plan = self._plan(market, timeframe, since)
+        if plan is not None:
+            return plan
+        return self._measure(market, timeframe, since, self._request(Request(market, timeframe, since, LIMIT)))
+
+    async def _aprobe(self, market: str, timeframe: str, since: int):
         """
-        df = pd.DataFrame(self.client.fetch_ohlcv(request.market, request.timeframe, request.since, request.limit),
-                          columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        for i in range(len(df)):
-            df.at[i, 'timestamp'] = int(df.at[i, 'timestamp'])
+        Asynchronous version of _probe.
+        """
+        plan = await asyncio.to_thread(self._plan, market, timeframe, since)
+        if plan is not None:
+            return plan
+        ohlcv = await self._arequest(Request(market, timeframe, since, LIMIT))
+        return await asyncio.to_thread(self._measure, market, timeframe, since, ohlcv)
+
+    def _verify_page_size(self, market: str, timeframe: str, counts: np.ndarray, max_limit: int):
+        """
+        Drop the cached metadata of a market and timeframe if a page other than the last one was short, the page size
+        of the exchange changed and the next download measures it again.
+        :param counts: the number of candles of each page of a download.
+        """
+        if len(counts) > 1 and (counts[:-1] < max_limit).any():
+            self._set_market_info(market, timeframe, None)
+
+    def _schedule(self, market, timeframe, first, limit, tf, max_limit, verbose):
+        """
+        Schedule the requests of a download, see _probe.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param first: the timestamp of the first candle of the download in milliseconds.
+        :param limit: the limit parameter of download.
+        :param tf: the spacing between two candles in milliseconds.
+        :param max_limit: the maximum number of candles returned by the exchange in a single request.
+        :param verbose: whether to print the progress or not.
+        :return: a (requests, limit) tuple, limit is converted to a number of candles.
+        """
+        # Parse the limit to an integer
+        if limit == -1:
+            limit = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(limit, str):
+            limit = math.ceil((date_to_timestamp(limit) - first) / tf)
+
+        len_requests = math.ceil(limit / max_limit)
+        requests = []
+        for i in range(len_requests):
+            requests.append(Request(market, timeframe, first + i * max_limit * tf, LIMIT))
+
+        if verbose:
+            from_date = timestamp_to_date(first)
+            to_date = timestamp_to_date(first + (limit - 1) * tf)
+            self._message(f"Downloading {market} {timeframe} data from {from_date} to {to_date}", verbose)
+        return requests, limit
+
+    def _assemble(self, buffer, timeframe, limit, verbose):
+        """
+        Build the dataframe of a download, only the closed candles are kept.
+        :param buffer: the PageBuffer holding the responses.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param limit: the number of candles to keep.
+        :param verbose: whether to print the progress or not.
+        :return: the dataframe of the download.
+        :raise NotEnoughDataException: if the exchange did not return any closed candle.
+        """
+        self._message(f"Aggregating {buffer.pages} pages for a total of {limit} candles.", verbose)
+        df = buffer.frame(limit, self._closed(timeframe))
+        if df.empty:
+            raise NotEnoughDataException("Not enough data available for the requested market and timeframe.")
+        return df
+
+    def _report(self, df, report, market, timeframe, verbose):
+        """
+        Attach an integrity report to a dataframe, emit it and print a warning if the check failed.
+        :return: the dataframe.
+        """
+        self.metrics.emit('integrity', market=market, timeframe=timeframe, gaps=len(report.gaps),
+                          missing=report.missing)
+        if not report.ok and verbose:
+            msg = f"WARNING: Integrity check failed:\n  {report.missing} candles were detected as missing in " \
+                  f"{len(report.gaps)} gaps, this is most likely not a download issue but rather an exchange issue, " \
+                  f"some exchanges do not provide data for downtimes or other reasons."
+            if len(report.misaligned) or len(report.unordered):
+                msg += f"\n  {len(report.misaligned)} misaligned and {len(report.unordered)} out-of-order " \
+                       f"timestamps were detected."
+            self._message(msg, verbose, 'warning')
+        df.attrs['integrity'] = report
         return df
 
     def download(self, market: str, timeframe: str, since: str, limit: (int, str), verbose: bool = True,
-                 workers: int = 100):
+                 workers: int = 100, fill_gaps: bool = False):
         """
         Download an Ohlcv dataset from the exchange.
         :param market: the market as a string e.g. 'BTC/USDT', this market must be available on the exchange.
@@ -79,93 +545,73 @@ class OhlcvPlus:
         :param limit: the number of candles to download as an integer e.g. 1000, -1 to download all available data or
         a date as a string e.g. '2020-02-01 00:00:00'.
         :param verbose: whether to print the progress bar or not.
-        :param workers: the number of threads to use for downloading. A high number cand lead to several issues such
-        as missing data and exchange bans. Use with caution. If you encounter issues, try reducing this number,
-        default is 100.
+        :param workers: the number of threads to use for downloading. The request rate is bounded by the rate limiter
+        of this instance whatever the number of workers, default is 100.
+        :param fill_gaps: whether to re-fetch the windows detected as missing by the integrity check or not. Only the
+        missing windows are requested again.
 
         :return: a pandas DataFrame containing the downloaded data with the following columns: "timestamp", "open",
-        "high", "low", "close", "volume". Warning, the timestamp is in milliseconds.
+        "high", "low", "close", "volume". Warning, the timestamp is in milliseconds. The integrity report of the
+        data is available in df.attrs['integrity'].
         :raise Exception: Any exception raised by the ccxt library will be raised by this method. This method will also
         raise an exception if no data is available for the requested market and timeframe.
         """
+        return self._download(market, timeframe, since, limit, verbose, workers, fill_gaps, self.float32)
+
+    def _download(self, market: str, timeframe: str, since: str, limit: (int, str), verbose: bool, workers: int,
+                  fill_gaps: bool, float32: bool):
+        """
+        See download.
+        :param float32: whether to download the prices and volumes as float32, the downloads written to the storage
+        are always float64.
+        """
         # --- Pre Download ---
+        t = time.perf_counter()
         since = date_to_timestamp(since)
-        ohlcv = self._fetch_ohlcv(Request(market, timeframe, since, LIMIT))
-        if ohlcv.empty:
-            raise NotEnoughDataException("No data available for the requested market and timeframe.")
-        if len(ohlcv) == 1:
-            raise NotEnoughDataException("Not enough data available for the requested market and timeframe.")
-        max_limit = len(ohlcv)
-        tf = (ohlcv['timestamp'].iloc[1] - ohlcv['timestamp'].iloc[0])
-        # Parse the limit to an integer
-        if limit == -1:
-            limit = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if isinstance(limit, str):
-            limit = math.ceil((date_to_timestamp(limit) - ohlcv['timestamp'].iloc[0]) / tf)
+        first, tf, max_limit, page = self._probe(market, timeframe, since)
 
         # --- Scheduling ---
-        len_requests = math.ceil(limit / max_limit)
-        requests = []
-        for i in range(len_requests):
-            requests.append(Request(market, timeframe, since + i * max_limit * tf, LIMIT))
+        requests, limit = self._schedule(market, timeframe, first, limit, tf, max_limit, verbose)
+        len_requests = len(requests)
+        # Placeholders for the data, the response of the probe is the first page
+        buffer = PageBuffer(len_requests, max_limit, float32)
+        executed = 0
+        if page is not None and len_requests:
+            buffer.put(0, page)
+            executed = 1
         # load balancing
         jobs = [[] for _ in range(workers)]
-        for i in range(len_requests):
+        for i in range(executed, len_requests):
             jobs[i % workers].append(i)
+        self.metrics.emit('progress_start', total=len_requests, verbose=verbose)
 
-        # Set up the progress bar
-        from_date = timestamp_to_date(ohlcv['timestamp'].iloc[0])
-        to_date = timestamp_to_date(ohlcv['timestamp'].iloc[0] + (limit - 1) * tf)
-        bar = None
-        if verbose:
-            print(Fore.CYAN, f"Downloading {market} {timeframe} data from {from_date} to {to_date}", Fore.RESET)
-            bar = Bar(len_requests)
-
-        # Placeholders for the data
-        responses = {i: [None, multiprocessing.Semaphore(0)] for i in range(len_requests)}
-        executed = 0
-
-        # Placeholder for monitoring
-        rate_limited = False
+        errors = []
+        lock = threading.Lock()
 
         # --- Download ---
         def exec_requests(indexes):
-            nonlocal executed, rate_limited
-            for k in range(len(indexes)):
-                idx = indexes[k]
-                while True:
-                    while rate_limited:
-                        time.sleep(1)
-                    try:
-                        responses[idx][0] = self._fetch_ohlcv(requests[idx])
-                        responses[idx][1].release()
-                        executed += 1
-                        break
-                    except Exception as e:
-                        rate_limited = True
+            nonlocal executed
+            for idx in indexes:
+                if errors:
+                    return
+                try:
+                    buffer.put(idx, self._request(requests[idx]))
+                except Exception as e:
+                    errors.append(e)
+                    return
+                with lock:
+                    executed += 1
 
         def monitoring():
-            nonlocal executed, rate_limited
-
-            last_executed = 0
-            while executed < len_requests:
-                if last_executed != executed:
-                    last_executed = executed
-                if rate_limited:
-                    timer = 60
-                    while timer > 0:
-                        bar.update(executed, front=f"Rate limit reached, waiting for {timer} seconds")
-                        time.sleep(1)
-                        timer -= 1
-                    rate_limited = False
-
-                if verbose:
-                    bar.update(executed)
+            while executed < len_requests and not errors:
+                self.metrics.emit('progress', done=executed, rate_limited=self.rate_limiter.throttled,
+                                  rate=self.rate_limiter.rate, verbose=verbose)
                 time.sleep(0.1)
 
         # Start monitoring
         mt = threading.Thread(target=monitoring)
-        mt.start()
+        if verbose:
+            mt.start()
 
         # Start downloading
         threads = [threading.Thread(target=exec_requests, args=(jobs[i],)) for i in range(len(jobs))]
@@ -174,32 +620,103 @@ class OhlcvPlus:
         for thread in threads:
             thread.join()
 
-        mt.join()
-        bar.finish()
-
-        if verbose:
-            print(Fore.CYAN, f"Aggregating {len(requests)} dataframe for a total of {limit} candles. This might take "
-                             f"some time.", Fore.RESET)
-        df = pd.concat([responses[i][0] for i in range(len(requests))], ignore_index=True).iloc[:-1].iloc[:limit]
-        df = df.drop_duplicates(subset=['timestamp'])
-        df = df.reset_index(drop=True)
         if verbose:
-            print(Fore.CYAN, f"Verifying data integrity.", Fore.RESET)
-        ic = 0
-        for i in range(1, len(df)):
-            if df['timestamp'].iloc[i] - df['timestamp'].iloc[i - 1] != tf:
-                # Check the number of missing candles
-                missing = int((df['timestamp'].iloc[i] - df['timestamp'].iloc[i - 1]) / tf)
-                ic += missing
-
-        if ic > 0 and verbose:
-            msg = f"WARNING: Integrity check failed:\n  {ic} candles were detected as missing, this is most likely " \
-                  f"not a download issue but rather an exchange issue, some exchanges do not provide data for " \
-                  f"downtimes or other reasons."
-            print(Fore.YELLOW, msg, Fore.RESET)
+            mt.join()
+        self.metrics.emit('progress_end', verbose=verbose)
+        if errors:
+            raise errors[0]
+
+        df = self._assemble(buffer, timeframe, limit, verbose)
+        self._verify_page_size(market, timeframe, buffer.counts, max_limit)
+        self._message(f"Verifying data integrity.", verbose)
+        report = check_integrity(df['timestamp'], tf)
+        if report.gaps and fill_gaps:
+            gaps = self._gap_requests(report, market, timeframe, max_limit, verbose)
+            df = self._merge_gaps(df, [(gap, self._request(request)) for gap, request in gaps])
+            report = check_integrity(df['timestamp'], tf)
+        df = self._report(df, report, market, timeframe, verbose)
+        self.metrics.emit('download', market=market, timeframe=timeframe, rows=len(df),
+                          seconds=time.perf_counter() - t)
         return df
 
-    def update(self, dataframe: pd.DataFrame, market: str, timeframe: str, verbose: bool = True, workers: int = 100):
+    async def adownload(self, market: str, timeframe: str, since: str, limit: (int, str), verbose: bool = True,
+                        workers: int = 100, fill_gaps: bool = False):
+        """
+        Asynchronous version of download built on ccxt.async_support. Requests are run as coroutines in the running
+        event loop, at most 'workers' of them are in flight at the same time and they share the http session of the
+        asynchronous client. Aggregation is run in a thread so the event loop is not blocked. Call aclose once done.
+        See download for the parameters and the returned value.
+        """
+        return await self._adownload(market, timeframe, since, limit, verbose, workers, fill_gaps, self.float32)
+
+    async def _adownload(self, market: str, timeframe: str, since: str, limit: (int, str), verbose: bool,
+                         workers: int, fill_gaps: bool, float32: bool):
+        """
+        See adownload and _download.
+        """
+        # --- Pre Download ---
+        t = time.perf_counter()
+        since = date_to_timestamp(since)
+        first, tf, max_limit, page = await self._aprobe(market, timeframe, since)
+
+        # --- Scheduling ---
+        requests, limit = self._schedule(market, timeframe, first, limit, tf, max_limit, verbose)
+        self.metrics.emit('progress_start', total=len(requests), verbose=verbose)
+        buffer = PageBuffer(len(requests), max_limit, float32)
+        executed = 0
+        if page is not None and requests:
+            buffer.put(0, page)
+            executed = 1
+        pending = iter(range(executed, len(requests)))
+
+        # --- Download ---
+        async def exec_requests():
+            nonlocal executed
+            for idx in pending:
+                buffer.put(idx, await self._arequest(requests[idx]))
+                executed += 1
+                self.metrics.emit('progress', done=executed, rate_limited=self.rate_limiter.throttled,
+                                  rate=self.rate_limiter.rate, verbose=verbose)
+
+        tasks = [asyncio.ensure_future(exec_requests()) for _ in range(max(1, min(workers, len(requests))))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        self.metrics.emit('progress_end', verbose=verbose)
+
+        df = await asyncio.to_thread(self._assemble, buffer, timeframe, limit, verbose)
+        await asyncio.to_thread(self._verify_page_size, market, timeframe, buffer.counts, max_limit)
+        report = await asyncio.to_thread(check_integrity, df['timestamp'], tf)
+        if report.gaps and fill_gaps:
+            gaps = self._gap_requests(report, market, timeframe, max_limit, verbose)
+            pages = await asyncio.gather(*(self._arequest(request) for _, request in gaps))
+            df = self._merge_gaps(df, [(gap, page) for (gap, _), page in zip(gaps, pages)])
+            report = check_integrity(df['timestamp'], tf)
+        df = self._report(df, report, market, timeframe, verbose)
+        self.metrics.emit('download', market=market, timeframe=timeframe, rows=len(df),
+                          seconds=time.perf_counter() - t)
+        return df
+
+    def close(self):
+        """
+        Commit the pending writes and close the connections to the database.
+        """
+        if self.conn is not None:
+            self.conn.close()
+
+    async def aclose(self):
+        """
+        Close the http session of the asynchronous client, it must be called from the event loop that used it.
+        """
+        if self.async_client is not None:
+            await self.async_client.close()
+            self.async_client = None
+
+    def update(self, dataframe: pd.DataFrame, market: str, timeframe: str, verbose: bool = True, workers: int = 100,
+               fill_gaps: bool = False):
         """
         Update an existing dataframe with new data.
         :param dataframe: the dataframe to update.
@@ -209,108 +726,1069 @@ class OhlcvPlus:
         :param workers: the number of threads to use for downloading. A high number cand lead to several issues such
         as missing data and exchange bans. Use with caution. If you encounter issues, try reducing this number,
         default is 100.
+        :param fill_gaps: whether to re-fetch the windows detected as missing by the integrity check or not.
         """
         since = timestamp_to_date(dataframe['timestamp'].iloc[-1])
         limit = -1
-        if verbose:
-            print(Fore.CYAN, f"Updating {market} {timeframe} data from {since}", Fore.RESET)
+        self._message(f"Updating {market} {timeframe} data from {since}", verbose)
+        try:
+            new_data = self.download(market, timeframe, since, limit, verbose, workers, fill_gaps)
+        except NotEnoughDataException:
+            return dataframe
+        return self._extend(dataframe, new_data)
+
+    async def aupdate(self, dataframe: pd.DataFrame, market: str, timeframe: str, verbose: bool = True,
+                      workers: int = 100, fill_gaps: bool = False):
+        """
+        Asynchronous version of update, see adownload.
+        """
+        since = timestamp_to_date(dataframe['timestamp'].iloc[-1])
+        self._message(f"Updating {market} {timeframe} data from {since}", verbose)
         try:
-            new_data = self.download(market, timeframe, since, limit, verbose, workers)
+            new_data = await self.adownload(market, timeframe, since, -1, verbose, workers, fill_gaps)
         except NotEnoughDataException:
             return dataframe
+        return await asyncio.to_thread(self._extend, dataframe, new_data)
+
+    @staticmethod
+    def _extend(dataframe: pd.DataFrame, new_data: pd.DataFrame):
+        """
+        Append new candles to a dataframe, the candles already in the dataframe are kept.
+        """
         df = pd.concat([dataframe, new_data], ignore_index=True)
         df = df.drop_duplicates(subset=['timestamp'])
         df = df.reset_index(drop=True)
         return df
 
+    def _save(self, signature: str, market: str, timeframe: str, df: pd.DataFrame, verbose: bool, start: int = None,
+              end: int = None):
+        """
+        Save a dataframe to the storage and register it in the main table. A series can cover several disjoint windows,
+        the window of the dataframe is added to them, see _cover.
+        :param signature: the signature of the series.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param df: the dataframe to save.
+        :param verbose: whether to print the progress or not.
+        :param start: the start in milliseconds of the window covered by the dataframe: every candle of the exchange in
+        the window is in the dataframe. If None, the window starts with the first candle of the dataframe.
+        :param end: the end in milliseconds (excluded) of the window covered by the dataframe. If None, the window ends
+        with the last candle of the dataframe.
+        :return: whether the dataframe was saved or not, an empty dataframe is not.
+        """
+        if df.empty:
+            return False
+        start = int(df['timestamp'].iloc[0]) if start is None else start
+        end = int(df['timestamp'].iloc[-1]) + self._span(timeframe) if end is None else end
+        self._message(f"Saving {market} {timeframe} data to the database.", verbose)
+        saved = self._write_series(signature, market, timeframe, df, start, end)
+        # The series is known once it is committed, so the other threads never read it before
+        self.signatures.add(signature)
+        return saved
+
+    @writes
+    def _write_series(self, signature: str, market: str, timeframe: str, df: pd.DataFrame, start: int, end: int):
+        """
+        Write a dataframe to the storage and the window covered by the series to the main table, see _save.
+        """
+        registered = signature in self.signatures
+        if not registered:
+            # Add the series to the main table, another process can have registered it in the meantime
+            self.storage.create(signature)
+            inserted = self.conn.execute(
+                insert(self.table).values(signature=signature, exchange=self.client.name, market=market,
+                                          timeframe=timeframe, since=start, limit=int(df['timestamp'].iloc[-1]),
+                                          until=end).on_conflict_do_nothing()).rowcount
+            if inserted:
+                # The storage can hold the pages of an interrupted checkpointed download, they are not covered
+                self.storage.clear(signature)
+                self.conn.execute(self.checkpoints.delete().where(self.checkpoints.c.signature == signature))
+            self.conn.commit()
+
+        # Only the candles outside the covered windows and from the last stored one are written, the last stored
+        # candle is written again as it might have been incomplete. The upsert makes overlapping rows harmless.
+        new = df
+        if self.storage.bounds(signature) is not None:
+            ts = df['timestamp'].to_numpy()
+            covered = np.zeros(len(ts), dtype=bool)
+            for since, until in self._intervals(signature, timeframe):
+                covered[np.searchsorted(ts, since):np.searchsorted(ts, until)] = True
+            new = df[~covered | (ts >= self._last(signature))]
+        self.storage.write(signature, new)
+        self.storage.commit()
+
+        # Update the main table, limit is the last stored candle
+        self._merge_coverage(signature, timeframe, start, end)
+        c = self.table.c
+        self.conn.execute(self.table.update().where(c.signature == signature).values(
+            limit=self.storage.bounds(signature)[1]))
+        self.conn.commit()
+        return True
+
+    @writes
+    def _cover(self, signature: str, timeframe: str, start: int, end: int):
+        """
+        Record that a series covers the window [start, end), even if the exchange has no candle in it. Loading a window
+        of the series only downloads the parts of it which are not covered, see _gaps.
+        :param signature: the signature of the series.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param start: the timestamp in milliseconds, nothing is recorded if None.
+        :param end: the timestamp in milliseconds (excluded), nothing is recorded if None.
+        """
+        if start is None or end is None or start >= end:
+            return
+        self._merge_coverage(signature, timeframe, start, end)
+        self.conn.commit()
+
+    def _merge_coverage(self, signature: str, timeframe: str, start: int, end: int):
+        """
+        Add the window [start, end) to the windows covered by a registered series, the windows overlapping or touching
+        it are merged with it. The main table records the bounds of the covered windows. Only called by the methods
+        decorated with writes.
+        """
+        intervals = []
+        for since, until in self._intervals(signature, timeframe):
+            if until < start or since > end:
+                intervals.append((since, until))
+            else:
+                start, end = min(start, since), max(end, until)
+        intervals = sorted(intervals + [(start, end)])
+        self.conn.execute(self.coverage.delete().where(self.coverage.c.signature == signature))
+        self.conn.execute(insert(self.coverage), [{'signature': signature, 'since': since, 'until': until}
+                                                  for since, until in intervals])
+        self.conn.execute(self.table.update().where(self.table.c.signature == signature).values(
+            since=intervals[0][0], until=intervals[-1][1]))
+
+    def _checkpointed_download(self, signature: str, market: str, timeframe: str, since: str, limit: (int, str),
+                               verbose: bool, workers: int, fill_gaps: bool):
+        """
+        Download an ohlcv straight to the storage. Completed pages are written by batches of CHECKPOINT_PAGES, each
+        batch is committed together with the request windows it completes, so a download interrupted by a crash, a ban
+        or Ctrl-C only fetches the remaining windows when it is started again with the same arguments. The series is
+        registered in the main table once every window is stored. See download for the parameters.
+        :param signature: the signature of the series.
+        :return: the stored dataframe of the download.
+        """
+        # --- Pre Download ---
+        t = time.perf_counter()
+        start = date_to_timestamp(since)
+        first, tf, max_limit, page = self._probe(market, timeframe, start)
+
+        # --- Scheduling ---
+        requests, limit = self._schedule(market, timeframe, first, limit, tf, max_limit, verbose)
+        end = first + limit * tf
+        c = self.checkpoints.c
+        done = {s[0] for s in self.conn.execute(orm.select(c.since).where(c.signature == signature)).fetchall()}
+        todo = [i for i, request in enumerate(requests) if request.since not in done]
+        if done:
+            self._message(f"Resuming the download, {len(requests) - len(todo)} of {len(requests)} pages are already "
+                          f"stored.", verbose)
+        self._store_pages(signature, None, [])
+        self.metrics.emit('progress_start', total=len(todo), verbose=verbose)
+
+        def closed(page):
+            # Only the closed candles of the window are stored
+            ts = page[:, 0]
+            return page[(ts < end) & (ts + tf <= time.time() * 1000)]
+
+        batch = []
+        executed = 0
+        # The response of the probe is the first page
+        if page is not None and todo and todo[0] == 0:
+            batch.append((todo.pop(0), closed(page)))
+            executed = 1
+        pending = iter(todo)
+        errors = []
+        stop = threading.Event()
+        lock = threading.Lock()
+        write_lock = threading.Lock()
+
+        def flush():
+            with lock:
+                pages = batch[:]
+                batch.clear()
+            if not pages:
+                return
+            with write_lock:
+                data = np.concatenate([page for _, page in pages])
+                _, unique = np.unique(data[:, 0], return_index=True)
+                # The last window is never checkpointed, it ends with the current candle which is not closed yet
+                windows = [{'signature': signature, 'since': requests[idx].since} for idx, _ in pages
+                           if idx < len(requests) - 1]
+                self._store_pages(signature, page_frame(data[unique]), windows)
+
+        # --- Download ---
+        def exec_requests():
+            nonlocal executed
+            while not errors and not stop.is_set():
+                with lock:
+                    idx = next(pending, None)
+                if idx is None:
+                    return
+                try:
+                    page = closed(self._request(requests[idx]))
+                except Exception as e:
+                    errors.append(e)
+                    return
+                with lock:
+                    batch.append((idx, page))
+                    executed += 1
+                    full = len(batch) >= CHECKPOINT_PAGES
+                    self.metrics.emit('progress', done=executed, rate_limited=self.rate_limiter.throttled,
+                                      rate=self.rate_limiter.rate, verbose=verbose)
+                if full:
+                    flush()
+
+        threads = [threading.Thread(target=exec_requests) for _ in range(max(1, min(workers, len(todo))))]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            # The completed pages are stored whatever happened, Ctrl-C included
+            stop.set()
+            for thread in threads:
+                thread.join()
+            flush()
+            self.metrics.emit('progress_end', verbose=verbose)
+        if errors:
+            raise errors[0]
+
+        self._message(f"Verifying data integrity.", verbose)
+        df = self.storage.read(signature, start, end)
+        if df.empty:
+            raise NotEnoughDataException("Not enough data available for the requested market and timeframe.")
+        report = check_integrity(df['timestamp'], tf)
+        if report.gaps and fill_gaps:
+            gaps = self._gap_requests(report, market, timeframe, max_limit, verbose)
+            patch = self._merge_gaps(df.iloc[0:0], [(gap, self._request(request)) for gap, request in gaps])
+            self._store_pages(signature, patch, [])
+            df = self.storage.read(signature, start, end)
+            report = check_integrity(df['timestamp'], tf)
+
+        # --- Registration ---
+        self._register(signature, market, timeframe)
+        self.signatures.add(signature)
+        df = self._report(df, report, market, timeframe, verbose)
+        self.metrics.emit('download', market=market, timeframe=timeframe, rows=len(df),
+                          seconds=time.perf_counter() - t)
+        return df
+
+    @writes
+    def _store_pages(self, signature: str, df: pd.DataFrame, windows: list):
+        """
+        Write pages of a checkpointed download with the request windows they complete in a single transaction.
+        :param signature: the signature of the series, it is created if needed.
+        :param df: the candles of the pages, None to only create the series.
+        :param windows: the checkpoint rows of the completed windows.
+        """
+        self.storage.create(signature)
+        if df is not None:
+            self.storage.write(signature, df)
+        if windows:
+            # Another process resuming the same download can have stored the same windows
+            self.conn.execute(insert(self.checkpoints).on_conflict_do_nothing(), windows)
+        self.storage.commit()
+        self.conn.commit()
+
+    @writes
+    def _register(self, signature: str, market: str, timeframe: str):
+        """
+        Register a series written by a checkpointed download in the main table and drop its checkpoints.
+        """
+        bounds = self.storage.bounds(signature)
+        until = bounds[1] + self._span(timeframe)
+        c = self.table.c
+        self.conn.execute(self.checkpoints.delete().where(self.checkpoints.c.signature == signature))
+        self.conn.execute(insert(self.table).values(
+            signature=signature, exchange=self.client.name, market=market, timeframe=timeframe, since=bounds[0],
+            limit=bounds[1], until=until).on_conflict_do_update(index_elements=['signature'], set_=dict(
+            since=orm.func.min(c.since, bounds[0]), limit=bounds[1],
+            until=orm.func.max(orm.func.coalesce(c.until, 0), until))))
+        self._merge_coverage(signature, timeframe, bounds[0], until)
+        self.storage.commit()
+        self.conn.commit()
+
+    def _last(self, signature: str):
+        """
+        :return: the timestamp of the last stored candle of a series, read from the main table.
+        """
+        return self.conn.execute(orm.select(self.table.c.limit).where(self.table.c.signature == signature)).scalar()
+
+    def _first(self, signature: str):
+        """
+        :return: the start of the window covered by a series in milliseconds, read from the main table.
+        """
+        return self.conn.execute(orm.select(self.table.c.since).where(self.table.c.signature == signature)).scalar()
+
+    def _covered(self, signature: str, timeframe: str):
+        """
+        :return: the (start, end) bounds of the windows covered by a series in milliseconds, end is excluded, read from
+        the main table.
+        """
+        c = self.table.c
+        since, last, until = self.conn.execute(
+            orm.select(c.since, c.limit, c.until).where(c.signature == signature)).one()
+        # The end of the windows covered by earlier versions is not recorded, it is the end of the last candle
+        return since, until if until is not None else last + self._span(timeframe)
+
+    def _intervals(self, signature: str, timeframe: str):
+        """
+        :return: the ordered list of the disjoint (start, end) windows covered by a series in milliseconds, end is
+        excluded. The exchange has no candle in these windows which is not stored.
+        """
+        c = self.coverage.c
+        rows = self.conn.execute(
+            orm.select(c.since, c.until).where(c.signature == signature).order_by(c.since)).fetchall()
+        # The series written by earlier versions cover a single window
+        return [tuple(r) for r in rows] if rows else [self._covered(signature, timeframe)]
+
+    def _signature(self, market: str, timeframe: str, since: str = None):
+        """
+        The signature of the series of a market and timeframe of this exchange. A series holds every candle stored for
+        its market and timeframe, loading it from another date extends it instead of downloading a new series.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param since: the starting date of the load. Databases written by earlier versions hold one series per
+        starting date, the series stored for this date is returned if there is one.
+        :return: the signature.
+        """
+        signature = generate_sign(self.client.name, market, timeframe)
+        if self.db is not None and since is not None and not self._registered(signature):
+            legacy = generate_sign(market, timeframe, since)
+            if self._registered(legacy):
+                return legacy
+        return signature
+
+    def _registered(self, signature: str):
+        """
+        :return: whether a series is registered in the main table. In concurrent mode, the series registered by other
+        processes since this instance was created are read from the main table.
+        """
+        if signature not in self.signatures and self.writer is not None and self._last(signature) is not None:
+            self.signatures.add(signature)
+        return signature in self.signatures
+
+    def _refresh(self, signature: str, market: str, timeframe: str, verbose: bool, workers: int, fill_gaps: bool,
+                 end: int = None):
+        """
+        Download the candles following the last stored candle of a series and append them to the storage.
+        :param end: the end of the download in milliseconds (excluded), None for the last candle.
+        :return: the number of downloaded candles.
+        """
+        last = self._last(signature)
+        since = timestamp_to_date(last)
+        limit = -1 if end is None else self._until(end, timeframe)
+        # The window is checked up to its last closed candle, it is checked again once another candle is closed
+        checked = self._closed(timeframe, end)
+        self._message(f"Updating {market} {timeframe} data from {since}", verbose)
+        try:
+            df = self._download(market, timeframe, since, limit, verbose, workers, fill_gaps, False)
+        except NotEnoughDataException:
+            # The exchange has no candle following the last stored one
+            self._cover(signature, timeframe, last, checked)
+            return 0
+        self._save(signature, market, timeframe, df, verbose, last, checked)
+        return len(df)
+
+    async def _arefresh(self, signature: str, market: str, timeframe: str, verbose: bool, workers: int,
+                        fill_gaps: bool, end: int = None):
+        """
+        Asynchronous version of _refresh.
+        """
+        last = await asyncio.to_thread(self._last, signature)
+        since = timestamp_to_date(last)
+        limit = -1 if end is None else self._until(end, timeframe)
+        checked = self._closed(timeframe, end)
+        self._message(f"Updating {market} {timeframe} data from {since}", verbose)
+        try:
+            df = await self._adownload(market, timeframe, since, limit, verbose, workers, fill_gaps, False)
+        except NotEnoughDataException:
+            await asyncio.to_thread(self._cover, signature, timeframe, last, checked)
+            return 0
+        await asyncio.to_thread(self._save, signature, market, timeframe, df, verbose, last, checked)
+        return len(df)
+
+    @staticmethod
+    def _span(timeframe: str):
+        """
+        :return: the length of a candle in milliseconds, the longest month for months.
+        """
+        try:
+            return timeframe_to_ms(timeframe)
+        except ValueError:
+            return 31 * 24 * 60 * 60 * 1000
+
+    @staticmethod
+    def _until(end: int, timeframe: str):
+        """
+        The limit of a download of the candles preceding 'end'. The candle in progress of months can not be computed,
+        the last candle of their downloads is dropped instead, so they end one candle after 'end'. The stored candles
+        downloaded again are not written by _save.
+        :param end: the end of the download in milliseconds (excluded).
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :return: the end date as a string.
+        """
+        if OhlcvPlus._closed(timeframe) is None:
+            end += OhlcvPlus._span(timeframe)
+        return timestamp_to_date(end)
+
+    @staticmethod
+    def _closed(timeframe: str, end: int = None):
+        """
+        :param end: the end of a window in milliseconds (excluded), None for an open window.
+        :return: the end of the closed candles of the window, the start of the candle in progress if the window is open
+        or ends after it. Months do not have a fixed length, end is returned.
+        """
+        try:
+            closed = bucket_start(int(time.time() * 1000), timeframe)
+        except ValueError:
+            return end
+        return closed if end is None else min(end, closed)
+
+    def _gaps(self, signature: str, timeframe: str, since: str, limit: (int, str), update: bool = False):
+        """
+        Find the parts of the window of a load which are not covered by a series.
+        :param since: the since parameter of load.
+        :param limit: the limit parameter of load. An open window starting before the end of the covered windows is only
+        checked up to it, the candles following it are downloaded by update.
+        :param update: whether the candles following the last stored one are downloaded by update, only the parts
+        preceding it are then returned.
+        :return: the ordered list of the (start, end) of the missing windows in milliseconds, end is excluded. Only
+        closed candles are missing.
+        """
+        start, end, count = self._window(since, limit)
+        intervals = self._intervals(signature, timeframe)
+        if count is not None:
+            try:
+                end = start + count * timeframe_to_ms(timeframe)
+            except ValueError:
+                # Months do not have a fixed length, the window is open
+                pass
+        if end is None and start < intervals[-1][1]:
+            end = intervals[-1][1]
+        end = self._closed(timeframe, end)
+        if end is None:
+            return []
+        gaps = []
+        for covered_start, covered_end in intervals:
+            if covered_start >= end:
+                break
+            if covered_start > start:
+                gaps.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            gaps.append((start, end))
+        if update:
+            last = self._last(signature)
+            gaps = [gap for gap in gaps if gap[0] < last]
+        return gaps
+
+    def _fill(self, signature: str, market: str, timeframe: str, gaps: list, verbose: bool, workers: int,
+              fill_gaps: bool):
+        """
+        Download the windows missing from a series and insert them to the storage.
+        :param gaps: the missing windows, see _gaps.
+        :return: the number of downloaded candles.
+        """
+        downloaded = 0
+        for start, end in gaps:
+            self._message(f"Downloading the missing {market} {timeframe} data from {timestamp_to_date(start)} to "
+                          f"{timestamp_to_date(end)}", verbose)
+            try:
+                df = self._download(market, timeframe, timestamp_to_date(start), self._until(end, timeframe), verbose,
+                                    workers, fill_gaps, False)
+            except NotEnoughDataException:
+                df = None
+            if df is not None:
+                df = df[df['timestamp'] < end]
+                downloaded += len(df)
+            # The exchange has no candle in the window
+            if df is None or not self._save(signature, market, timeframe, df, verbose, start, end):
+                self._cover(signature, timeframe, start, end)
+        return downloaded
+
+    async def _afill(self, signature: str, market: str, timeframe: str, gaps: list, verbose: bool, workers: int,
+                     fill_gaps: bool):
+        """
+        Asynchronous version of _fill.
+        """
+        downloaded = 0
+        for start, end in gaps:
+            self._message(f"Downloading the missing {market} {timeframe} data from {timestamp_to_date(start)} to "
+                          f"{timestamp_to_date(end)}", verbose)
+            try:
+                df = await self._adownload(market, timeframe, timestamp_to_date(start), self._until(end, timeframe),
+                                           verbose, workers, fill_gaps, False)
+            except NotEnoughDataException:
+                df = None
+            if df is not None:
+                df = df[df['timestamp'] < end]
+                downloaded += len(df)
+            if df is None or not await asyncio.to_thread(self._save, signature, market, timeframe, df, verbose, start,
+                                                         end):
+                await asyncio.to_thread(self._cover, signature, timeframe, start, end)
+        return downloaded
+
+    def refresh(self, market: str, timeframe: str, since: str, verbose: bool = True, workers: int = 100,
+                fill_gaps: bool = False):
+        """
+        Update a stored ohlcv with the latest candles. Only the last stored timestamp is read from the database, only
+        the missing candles are downloaded and they are appended to the database, so the cost of a refresh does not
+        depend on the size of the stored history.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param since: the starting date given to load, only used to find the series of databases written by earlier
+        versions, see _signature.
+        :param verbose: whether to print the progress bar or not.
+        :param workers: the number of threads to use for downloading, default is 100.
+        :param fill_gaps: whether to re-fetch the windows detected as missing by the integrity check or not.
+
+        :return: the number of downloaded candles.
+        :raise NotEnoughDataException: if the database is disabled or does not contain this ohlcv.
+        """
+        if self.db is None:
+            raise NotEnoughDataException("The database is disabled.")
+        signature = self._signature(market, timeframe, since)
+        if signature not in self.signatures:
+            raise NotEnoughDataException("The requested ohlcv is not stored in the database.")
+        return self._refresh(signature, market, timeframe, verbose, workers, fill_gaps)
+
+    @staticmethod
+    def _window(since: str, limit: (int, str)):
+        """
+        Convert the since and limit parameters of load to a window.
+        :param since: the starting date as a string e.g. '2021-01-01 00:00:00'.
+        :param limit: the number of candles, -1 for all available candles or an end date as a string.
+        :return: a (start, end, count) tuple, start and end are timestamps in milliseconds, end is excluded. end and
+        count are None when they do not bound the window.
+        """
+        start = date_to_timestamp(since)
+        if isinstance(limit, str):
+            return start, date_to_timestamp(limit), None
+        if limit == -1:
+            return start, None, None
+        return start, None, limit
+
+    @staticmethod
+    def _slice(df: pd.DataFrame, start: int, end: int = None, count: int = None):
+        """
+        Slice a sorted ohlcv dataframe to a window, see _window.
+        """
+        ts = df['timestamp']
+        lo = ts.searchsorted(start)
+        hi = len(df) if end is None else ts.searchsorted(end)
+        if count is not None:
+            hi = min(hi, lo + count)
+        return df.iloc[lo:hi].reset_index(drop=True)
+
+    def _cast(self, df: pd.DataFrame):
+        """
+        Cast the prices and volumes of a dataframe returned to the caller to float32 if this instance was created with
+        float32=True, the stored candles are float64.
+        """
+        if not self.float32:
+            return df
+        return df.astype({c: np.float32 for c in df.columns if c != 'timestamp'}, copy=False)
+
+    def _find_signature(self, market: str, timeframe: str, start: int, end: int = None):
+        """
+        Find the stored series of this exchange that best covers a window.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param start: the start of the window in milliseconds.
+        :param end: the end of the window in milliseconds (excluded), None for an open window.
+        :return: the signature of the series, or None if no stored series overlaps the window.
+        """
+        c = self.table.c
+        statement = orm.select(c.signature, c.since, c.limit).where(
+            c.exchange == self.client.name, c.market == market, c.timeframe == timeframe, c.limit >= start)
+        if end is not None:
+            statement = statement.where(c.since < end)
+        rows = self.conn.execute(statement).fetchall()
+        if not rows:
+            return None
+        # Prefer the series starting before the window, then the one reaching the furthest
+        return max(rows, key=lambda r: (r[1] <= start, r[2]))[0]
+
+    def _find_source(self, market: str, timeframe: str, start: int, end: int = None):
+        """
+        Find the stored series of this exchange from which a timeframe can be derived for a window.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe to derive as a string e.g. '1h'.
+        :param start: the start of the window in milliseconds.
+        :param end: the end of the window in milliseconds (excluded), None for an open window.
+        :return: a (signature, timeframe, end) tuple where end is the end of the window covered by the series, or None if
+        no stored series covers the window. The coarsest series is preferred as it is the fastest to aggregate.
+        """
+        try:
+            tf = timeframe_to_ms(timeframe)
+        except ValueError:
+            return None
+        c = self.table.c
+        rows = self.conn.execute(orm.select(c.signature, c.timeframe, c.since, c.limit).where(
+            c.exchange == self.client.name, c.market == market, c.timeframe != timeframe, c.since <= start)).fetchall()
+        sources = []
+        for signature, source_timeframe, _, last in rows:
+            try:
+                source_tf = timeframe_to_ms(source_timeframe)
+            except ValueError:
+                continue
+            covered = last + source_tf
+            if tf % source_tf == 0 and (end is None or covered >= end):
+                sources.append((source_tf, signature, source_timeframe, covered))
+        if not sources:
+            return None
+        _, signature, source_timeframe, covered = max(sources)
+        return signature, source_timeframe, covered if end is None else end
+
+    def _resample(self, market: str, timeframe: str, start: int, end: int = None, cache: bool = False):
+        """
+        Derive a timeframe from a stored series, see resample.
+        :return: the derived dataframe, or None if no stored series covers the window.
+        """
+        source = self._find_source(market, timeframe, start, end)
+        if source is None:
+            return None
+        signature, source_timeframe, end = source
+        df = resample(self.storage.read(signature, start, end), timeframe, source_timeframe)
+        if cache and not df.empty:
+            self._save(self._signature(market, timeframe), market, timeframe, df, False, start)
+        return df
+
+    def resample(self, market: str, timeframe: str, start: str, end: str = None, cache: bool = False):
+        """
+        Derive a timeframe locally from a finer stored series of the same market, e.g. 1h candles from 1m candles,
+        instead of downloading it. Only the candles fully covered by the stored series are returned.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe to derive as a string e.g. '1h', months can not be derived.
+        :param start: the start date as a string e.g. '2021-01-01 00:00:00' (included).
+        :param end: the end date as a string e.g. '2021-02-01 00:00:00' (excluded). If None, the window ends with the
+        stored series.
+        :param cache: whether to save the derived series to the database or not, it is then loaded as any other series
+        by load and query.
+
+        :return: a pandas dataframe containing the ohlcv.
+        :raise NotEnoughDataException: if the database is disabled or no stored series covers the window.
+        """
+        if self.db is None:
+            raise NotEnoughDataException("The database is disabled.")
+        end = date_to_timestamp(end) if end is not None else None
+        df = self._resample(market, timeframe, date_to_timestamp(start), end, cache)
+        if df is None:
+            raise NotEnoughDataException("No stored series covers the requested window.")
+        return df
+
+    def query(self, market: str, timeframe: str, start: str, end: str = None):
+        """
+        Read a time window of a stored ohlcv, only the requested candles are read from the database. Nothing is
+        downloaded.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param start: the start date as a string e.g. '2021-01-01 00:00:00' (included).
+        :param end: the end date as a string e.g. '2021-02-01 00:00:00' (excluded). If None, all the candles from the
+        start date are returned.
+
+        :return: a pandas dataframe containing the ohlcv. If this timeframe is not stored, it is derived from a finer
+        stored series of the same market when possible, see resample.
+        :raise NotEnoughDataException: if the database is disabled or does not contain this market and timeframe for
+        the requested window.
+        """
+        if self.db is None:
+            raise NotEnoughDataException("The database is disabled.")
+        start = date_to_timestamp(start)
+        end = date_to_timestamp(end) if end is not None else None
+        signature = self._find_signature(market, timeframe, start, end)
+        if signature is not None:
+            return self.storage.read(signature, start, end)
+        df = self._resample(market, timeframe, start, end)
+        if df is None:
+            raise NotEnoughDataException("No data stored for the requested market, timeframe and window.")
+        return df
+
     def load(self, market: str, timeframe: str, since: str, limit: (int, str), update: bool = False,
-             verbose: bool = True, workers: int = 100):
+             verbose: bool = True, workers: int = 100, fill_gaps: bool = False, derive: bool = False,
+             checkpoint: bool = False):
         """
         Load an ohlcv. If you initialized this class with None as 'database_path' parameter, this method will download
         the data. Otherwise, it will load the data from the database. If the database does not contain the data, it
-        will download it and save it to the database.
+        will download it and save it to the database. The database holds a single series per market and timeframe: only
+        the candles of the window which are not stored yet are downloaded and inserted in it.
         :param market: the market as a string e.g. 'BTC/USDT', this market must be available on the exchange.
         :param timeframe: the timeframe as a string e.g. '1m', this timeframe must be available on the exchange.
         :param since: the starting date as a string e.g. '2021-01-01 00:00:00'.
         :param limit: the number of candles to download, if -1, all available candles will be downloaded.
-        :param update: whether to update the data or not.
+        :param update: whether to download the candles following the last stored one or not. Without update, they are
+        only downloaded when the window of 'limit' ends after the last stored candle.
         :param verbose: whether to print the progress bar or not.
         :param workers: the number of threads to use for downloading. A high number cand lead to several issues such
         as missing data and exchange bans. Use with caution. If you encounter issues, try reducing this number,
         default is 100.
+        :param fill_gaps: whether to re-fetch the windows detected as missing by the integrity check or not.
+        :param derive: whether to derive the ohlcv from a finer stored series of the same market instead of downloading
+        it when this series is not stored and the finer one covers the whole window, see resample.
+        :param checkpoint: whether to write the pages to the database as they arrive instead of once the download is
+        done. The completed request windows are recorded, so if the download is interrupted, calling load again with
+        the same arguments only downloads the remaining windows. Recommended for deep histories.
 
         :return: a pandas dataframe containing the ohlcv.
         :raise Exception: Raise any exception that might occur during the download.
         """
         if self.db is None:
-            return self.download(market, timeframe, since, limit, verbose, workers)
+            return self.download(market, timeframe, since, limit, verbose, workers, fill_gaps)
         else:
-            signature = generate_sign(market, timeframe, since)
-            if signature not in self.tables:
-                # Download the data
-                df = self.download(market, timeframe, since, limit, verbose, workers)
+            signature = self._signature(market, timeframe, since)
+            # Months do not have a fixed length, they can not be derived
+            if signature not in self.signatures and derive and timeframe[-1] != 'M':
+                start, end, count = self._window(since, limit)
+                if count is not None:
+                    end = start + count * timeframe_to_ms(timeframe)
+                elif end is None:
+                    end = bucket_start(int(time.time() * 1000), timeframe)
+                df = self._resample(market, timeframe, start, end)
+                if df is not None:
+                    self._message(f"Deriving {market} {timeframe} data from a stored series.", verbose)
+                    return self._cast(self._slice(df, start, end, count))
+            if signature not in self.signatures and checkpoint:
+                df = self._checkpointed_download(signature, market, timeframe, since, limit, verbose, workers,
+                                                 fill_gaps)
+                self._cover(signature, timeframe, date_to_timestamp(since), self._first(signature))
+                return self._cast(self._slice(df, *self._window(since, limit)))
+            if signature not in self.signatures:
+                # Download the data, the returned window only is cast to float32
+                df = self._download(market, timeframe, since, limit, verbose, workers, fill_gaps, False)
             else:
-                if verbose:
-                    print(Fore.CYAN, f"Dataframe found in the database, loading it.", Fore.RESET)
-                # Load the data
-                t = self.tables[signature]
-                # Select timestamp open high low close volume
-                data = self.conn.execute(t.select()).fetchall()
-                df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+                self._message(f"Dataframe found in the database, loading it.", verbose)
+                # Only the missing candles are downloaded and inserted, then only the requested window is read
+                self._fill(signature, market, timeframe, self._gaps(signature, timeframe, since, limit, update),
+                           verbose, workers, fill_gaps)
                 if update:
-                    df = self.update(df, market, timeframe, verbose, workers)
-
-            if signature not in self.tables or update:
-                if signature not in self.tables:
-                    # Create the table
-                    t = orm.Table(signature, self.metadata,
-                                  orm.Column('timestamp', orm.BigInteger, primary_key=True),
-                                  orm.Column('open', orm.Float),
-                                  orm.Column('high', orm.Float),
-                                  orm.Column('low', orm.Float),
-                                  orm.Column('close', orm.Float),
-                                  orm.Column('volume', orm.Float))
-                    self.metadata.create_all(self.db)
-                    # Add the table to the main table
-                    self.tables[signature] = t
-                    _since = int(df['timestamp'].iloc[0])
-                    _to = int(df['timestamp'].iloc[-1])
-                    self.conn.execute(
-                        self.table.insert().values(signature=signature, exchange=self.client.name,
-                                                   market=market, timeframe=timeframe,
-                                                   since=_since, limit=_to))
-                    self.conn.commit()
-
-                # Save the data
-                t = self.tables[signature]
-                print(Fore.CYAN, f"Saving {market} {timeframe} data to the database.", Fore.RESET)
-                # Update the database table (t) will all new data
-                # Check if the database is empty
-                if self.conn.execute(t.select()).fetchone() is None:
-                    # Insert all the data
-                    self.conn.execute(t.insert(),
-                                      [{'timestamp': row['timestamp'], 'open': row['open'], 'high': row['high'],
-                                        'low': row['low'], 'close': row['close'], 'volume': row['volume']} for
-                                       _, row in df.iterrows()])
-                else:
-                    to = self.conn.execute(self.table.select().where(self.table.c.signature == signature)).fetchone()[5]
-                    data = [{'timestamp': row['timestamp'], 'open': row['open'], 'high': row['high'],
-                                'low': row['low'], 'close': row['close'], 'volume': row['volume']} for _, row in
-                                df.iterrows() if row['timestamp'] > to]
-                    if len(data) > 0:
-                        self.conn.execute(t.insert(), data)
-                self.conn.commit()
-
-                # Update the main table
-                self.conn.execute(self.table.update().where(self.table.c.signature == signature).values(
-                    limit=int(df['timestamp'].iloc[-1])))
-                self.conn.commit()
+                    self._refresh(signature, market, timeframe, verbose, workers, fill_gaps)
+                return self._cast(self.storage.read(signature, *self._window(since, limit)))
+
+            self._save(signature, market, timeframe, df, verbose, date_to_timestamp(since))
             # truncate the dataframe according to the limit
-            tf = (df['timestamp'].iloc[1] - df['timestamp'].iloc[0])
-            # Parse the limit to an integer
-            if limit == -1:
-                limit = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if isinstance(limit, str):
-                limit = math.ceil((date_to_timestamp(limit) - df['timestamp'].iloc[0]) / tf)
-            df.truncate(after=limit-1)
-            return df
\ No newline at end of file
+            return self._cast(self._slice(df, *self._window(since, limit)))
+
+    async def aload(self, market: str, timeframe: str, since: str, limit: (int, str), update: bool = False,
+                    verbose: bool = True, workers: int = 100, fill_gaps: bool = False):
+        """
+        Asynchronous version of load. Downloads are run with adownload and the database is accessed from a thread so
+        the event loop is never blocked. See load for the parameters and the returned value.
+        """
+        if self.db is None:
+            return await self.adownload(market, timeframe, since, limit, verbose, workers, fill_gaps)
+        signature = self._signature(market, timeframe, since)
+        if signature not in self.signatures:
+            df = await self._adownload(market, timeframe, since, limit, verbose, workers, fill_gaps, False)
+        else:
+            self._message(f"Dataframe found in the database, loading it.", verbose)
+            gaps = await asyncio.to_thread(self._gaps, signature, timeframe, since, limit, update)
+            await self._afill(signature, market, timeframe, gaps, verbose, workers, fill_gaps)
+            if update:
+                await self._arefresh(signature, market, timeframe, verbose, workers, fill_gaps)
+            df = await asyncio.to_thread(self.storage.read, signature, *self._window(since, limit))
+            return self._cast(df)
+        await asyncio.to_thread(self._save, signature, market, timeframe, df, verbose, date_to_timestamp(since))
+        return self._cast(self._slice(df, *self._window(since, limit)))
+
+    def load_many(self, series: list, update: bool = False, verbose: bool = True, workers: int = 100,
+                  fill_gaps: bool = False):
+        """
+        Load several ohlcv at once. The requests of every series are put in a single work queue consumed by a single
+        pool of threads, so the whole batch shares the rate limiter of this instance and no time is lost between two
+        series. Each series is saved to the database as soon as all its requests are done.
+        :param series: a list of (market, timeframe, since, limit) tuples, see load for the meaning of each element.
+        :param update: whether to update the series found in the database or not.
+        :param verbose: whether to print the progress bar or not.
+        :param workers: the number of threads to use for downloading, shared by all the series, default is 100.
+        :param fill_gaps: whether to re-fetch the windows detected as missing by the integrity check or not.
+
+        :return: a list of pandas dataframes, in the order of 'series'.
+        :raise Exception: the first exception raised while loading a series, once all the other series are done.
+        """
+        jobs = [Job(*s) for s in series]
+        rounds = [jobs]
+        if self.db is not None:
+            # The loads of a same series are run one after the other, each one only downloads the candles missing from
+            # the series stored by the previous ones
+            rounds = []
+            occurrences = {}
+            for job in jobs:
+                job.signature = self._signature(job.market, job.timeframe, job.since)
+                n = occurrences[job.signature] = occurrences.get(job.signature, -1) + 1
+                if n == len(rounds):
+                    rounds.append([])
+                rounds[n].append(job)
+        for batch in rounds:
+            self._load_jobs(batch, update, verbose, workers, fill_gaps)
+
+        for job in jobs:
+            if job.error is not None:
+                raise job.error
+        if self.db is None:
+            return [job.result for job in jobs]
+        return [self._cast(self.storage.read(job.signature, *self._window(job.since, job.limit))) for job in jobs]
+
+    def _load_jobs(self, jobs: list, update: bool, verbose: bool, workers: int, fill_gaps: bool):
+        """
+        Run the downloads of a list of jobs of load_many, each one loading a different series. The error of a job is set
+        instead of being raised.
+        """
+        tasks = queue.Queue()
+        lock = threading.Lock()
+        executed = 0
+        total = 0
+
+        def download(job, start, fetch, cover):
+            # A download of a window missing from a stored series, the series is read once every one is stored
+            part = Job(job.market, job.timeframe, timestamp_to_date(start), fetch)
+            part.signature, part.stored, part.parent, part.cover = job.signature, True, job, cover
+            tasks.put((part, None))
+
+        downloaded = 0
+        for job in jobs:
+            if self.db is None:
+                tasks.put((job, None))
+                downloaded += 1
+                continue
+            if job.signature in self.signatures:
+                gaps = self._gaps(job.signature, job.timeframe, job.since, job.limit, update)
+                job.stored = True
+                for start, end in gaps:
+                    download(job, start, self._until(end, job.timeframe), (start, end))
+                if update:
+                    # The candles following the last stored one are downloaded up to the last closed candle
+                    last = self._last(job.signature)
+                    download(job, last, -1, (last, self._closed(job.timeframe)))
+                downloaded += bool(gaps) or update
+                continue
+            # The first task of a series is the request returning the page size and the timeframe
+            tasks.put((job, None))
+            downloaded += 1
+        self._message(f"Loading {len(jobs)} series, {downloaded} of them from the exchange.", verbose)
+        total = tasks.qsize()
+        self.metrics.emit('progress_start', total=total, verbose=verbose)
+
+        def complete(job):
+            df = self._assemble(job.buffer, job.timeframe, job.count, False)
+            self._verify_page_size(job.market, job.timeframe, job.buffer.counts, job.max_limit)
+            report = check_integrity(df['timestamp'], job.tf)
+            if report.gaps and fill_gaps:
+                gaps = self._gap_requests(report, job.market, job.timeframe, job.max_limit, False)
+                df = self._merge_gaps(df, [(gap, self._request(request)) for gap, request in gaps])
+                report = check_integrity(df['timestamp'], job.tf)
+            df = self._report(df, report, job.market, job.timeframe, False)
+            if self.db is None:
+                job.result = self._slice(df, *self._window(job.since, job.limit))
+                return
+            start, end = job.cover
+            if end is not None:
+                # The candle in progress and the stored candles following the window are not written
+                df = df[df['timestamp'] < end]
+            with self.db_lock:
+                if not self._save(job.signature, job.market, job.timeframe, df, False, start, end):
+                    self._cover(job.signature, job.timeframe, start, end)
+
+        def exec_task(job, idx):
+            nonlocal total
+            if idx is None:
+                first, job.tf, job.max_limit, page = self._probe(job.market, job.timeframe, job.start)
+                job.requests, job.count = self._schedule(job.market, job.timeframe, first, job.fetch, job.tf,
+                                                         job.max_limit, False)
+                # The downloads written to the storage are float64, the results are cast once read
+                job.buffer = PageBuffer(len(job.requests), job.max_limit, self.float32 and self.db is None)
+                # The response of the probe is the first page
+                done = 0
+                if page is not None and job.requests:
+                    job.buffer.put(0, page)
+                    done = 1
+                job.remaining = len(job.requests) - done
+                with lock:
+                    total += job.remaining
+                if job.remaining == 0:
+                    complete(job)
+                for i in range(done, len(job.requests)):
+                    tasks.put((job, i))
+                return
+            job.buffer.put(idx, self._request(job.requests[idx]))
+            with lock:
+                job.remaining -= 1
+                last = job.remaining == 0
+            if last:
+                complete(job)
+
+        def worker():
+            nonlocal executed
+            while True:
+                task = tasks.get()
+                if task is None:
+                    tasks.task_done()
+                    return
+                job, idx = task
+                try:
+                    if job.error is None and job.result is None:
+                        exec_task(job, idx)
+                except NotEnoughDataException as e:
+                    if job.stored:
+                        # The exchange has no candle in the missing window
+                        self._cover(job.signature, job.timeframe, *job.cover)
+                    else:
+                        job.error = e
+                except Exception as e:
+                    job.error = e
+                    if job.parent is not None:
+                        job.parent.error = e
+                finally:
+                    with lock:
+                        executed += 1
+                        self.metrics.emit('progress', done=executed, total=total,
+                                          rate_limited=self.rate_limiter.throttled, rate=self.rate_limiter.rate,
+                                          verbose=verbose)
+                    tasks.task_done()
+
+        threads = [threading.Thread(target=worker) for _ in range(max(1, min(workers, tasks.qsize())))]
+        for thread in threads:
+            thread.start()
+        # Tasks scheduled by a probe are queued before the probe is marked as done, join returns once every
+        # request of every series is done
+        tasks.join()
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+        self.metrics.emit('progress_end', verbose=verbose)
+
+    def _stream(self, market: str, timeframe: str, since: int, end: int, workers: int):
+        """
+        Download an ohlcv page by page. Pages are yielded in order as soon as they and all the pages before them
+        arrived, at most 2 * workers pages are held in memory.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param since: the start of the download in milliseconds.
+        :param end: the end of the download in milliseconds (excluded).
+        :param workers: the number of threads to use for downloading.
+        :return: a generator of pages, see ohlcv.parsing.parse_page.
+        """
+        first, tf, max_limit, page = self._probe(market, timeframe, since)
+        requests, _ = self._schedule(market, timeframe, first, timestamp_to_date(end), tf, max_limit, False)
+        window = threading.Semaphore(2 * workers)
+        pending = iter(range(len(requests)))
+        pages = {}
+        # The response of the probe is the first page
+        if page is not None and requests:
+            window.acquire()
+            pages[next(pending)] = page
+        errors = []
+        cond = threading.Condition()
+        stop = threading.Event()
+
+        def exec_requests():
+            while True:
+                while not window.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                with cond:
+                    idx = next(pending, None)
+                if idx is None or stop.is_set():
+                    return
+                try:
+                    page = self._request(requests[idx])
+                except Exception as e:
+                    with cond:
+                        errors.append(e)
+                        cond.notify_all()
+                    return
+                with cond:
+                    pages[idx] = page
+                    cond.notify_all()
+
+        threads = [threading.Thread(target=exec_requests) for _ in range(max(1, min(workers, len(requests))))]
+        for thread in threads:
+            thread.start()
+        try:
+            for idx in range(len(requests)):
+                with cond:
+                    while idx not in pages and not errors:
+                        cond.wait()
+                    if errors:
+                        raise errors[0]
+                    page = pages.pop(idx)
+                window.release()
+                yield page
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def iter_load(self, market: str, timeframe: str, start: str, end: str = None, chunk_size: int = 100000,
+                  workers: int = 100):
+        """
+        Iterate over an ohlcv in chunks, so series larger than memory can be processed. If the series is stored, the
+        candles missing from the window are downloaded first, then it is read from the database chunk by chunk.
+        Otherwise the ohlcv is downloaded and the chunks are yielded as soon as their pages arrived, they are also saved
+        to the database if it is enabled. Only closed candles are returned.
+        :param market: the market as a string e.g. 'BTC/USDT'.
+        :param timeframe: the timeframe as a string e.g. '1m'.
+        :param start: the start date as a string e.g. '2021-01-01 00:00:00' (included).
+        :param end: the end date as a string e.g. '2021-02-01 00:00:00' (excluded). If None, the window ends with the
+        stored series, or with the last closed candle when downloading.
+        :param chunk_size: the number of candles of each chunk, the last chunk can be smaller.
+        :param workers: the number of threads to use for downloading, default is 100.
+
+        :return: a generator of pandas dataframes, ordered by timestamp and without duplicates.
+        :raise Exception: Raise any exception that might occur during the download.
+        """
+        start_ts = date_to_timestamp(start)
+        end_ts = date_to_timestamp(end) if end is not None else None
+        signature = self._signature(market, timeframe, start) if self.db is not None else None
+        if signature is not None and self._registered(signature):
+            # The candles missing from the stored series are downloaded first, then the whole window is read
+            gaps = self._gaps(signature, timeframe, start, end if end is not None else -1)
+            self._fill(signature, market, timeframe, gaps, False, workers, False)
+            # Chunks are read directly from the backend so a full scan does not evict the cached windows
+            storage = self.storage.storage if isinstance(self.storage, CachedStorage) else self.storage
+            cursor = start_ts
+            while True:
+                df = storage.read(signature, cursor, end_ts, chunk_size)
+                if not df.empty:
+                    yield self._cast(df)
+                if len(df) < chunk_size:
+                    return
+                cursor = int(df['timestamp'].iloc[-1]) + 1
+
+        # Only the closed candles are streamed. Months do not have a fixed length, so the candle in progress can not be
+        # computed: the series is streamed up to now and its last candle is dropped as PageBuffer.frame does.
+        now = int(time.time() * 1000)
+        end_ts = self._closed(timeframe, end_ts)
+        hold = 0
+        if end_ts is None or end_ts > now:
+            end_ts, hold = now + 1, 1
+        # The start of the window covered by the next chunk
+        covered = start_ts
+        buffer = []
+        buffered = 0
+        last = None
+        for page in self._stream(market, timeframe, start_ts, end_ts, workers):
+            ts = page[:, 0]
+            page = page[(ts < end_ts) if last is None else (ts > last) & (ts < end_ts)]
+            if len(page) == 0:
+                continue
+            last = page[-1, 0]
+            buffer.append(page)
+            buffered += len(page)
+            while buffered - hold >= chunk_size:
+                pages = np.concatenate(buffer)
+                chunk, rest = page_frame(pages[:chunk_size], self.float32 and self.db is None), pages[chunk_size:]
+                buffer, buffered = [rest], len(rest)
+                if self.db is not None:
+                    self._save(signature, market, timeframe, chunk, False, covered)
+                    covered = int(chunk['timestamp'].iloc[-1]) + 1
+                yield self._cast(chunk)
+        if buffered > hold:
+            chunk = page_frame(np.concatenate(buffer)[:buffered - hold], self.float32 and self.db is None)
+            if self.db is not None:
+                # The window is checked up to its end, or up to the last candle when it is dropped
+                self._save(signature, market, timeframe, chunk, False, covered, None if hold else end_ts)
+            yield self._cast(chunk)
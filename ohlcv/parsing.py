@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+from ohlcv.storage import COLUMNS
+
+
+def parse_page(ohlcv: list):
+    """
+    Convert a ccxt OHLCV response to a numpy array in a single pass, without creating any python object per cell.
+    :param ohlcv: a list of [timestamp, open, high, low, close, volume] lists.
+    :return: a float64 array of shape (n, 6), missing values are nan. Timestamps in milliseconds are exact in float64.
+    """
+    if not ohlcv:
+        return np.empty((0, len(COLUMNS)), dtype=np.float64)
+    return np.asarray(ohlcv, dtype=np.float64).reshape(len(ohlcv), len(COLUMNS))
+
+
+def page_frame(page: np.ndarray, float32: bool = False):
+    """
+    Build an ohlcv dataframe from a parsed page.
+    :param page: an array returned by parse_page.
+    :param float32: whether to store the prices and volumes as float32 or float64.
+    :return: a dataframe with an int64 timestamp column.
+    """
+    dtype = np.float32 if float32 else np.float64
+    return pd.DataFrame({'timestamp': page[:, 0].astype(np.int64),
+                         **{c: page[:, i + 1].astype(dtype) for i, c in enumerate(COLUMNS[1:])}}, copy=False)
+
+
+class PageBuffer:
+
+    def __init__(self, pages: int, page_size: int, float32: bool = False):
+        """
+        A preallocated columnar buffer receiving the pages of a download. Each page is written at its own slot as soon
+        as it arrives, in any order and from any thread, the final dataframe is then built from the columns without
+        any intermediate dataframe.
+        :param pages: the number of pages.
+        :param page_size: the maximum number of candles of a page, candles beyond it belong to the next page and are
+        ignored.
+        :param float32: whether to store the prices and volumes as float32 or float64.
+        """
+        self.pages = pages
+        self.page_size = page_size
+        capacity = pages * page_size
+        dtype = np.float32 if float32 else np.float64
+        self.timestamp = np.empty(capacity, dtype=np.int64)
+        self.values = {c: np.empty(capacity, dtype=dtype) for c in COLUMNS[1:]}
+        self.counts = np.zeros(pages, dtype=np.int64)
+
+    def put(self, index: int, page: np.ndarray):
+        """
+        Write a parsed page at its slot.
+        :param index: the index of the page.
+        :param page: an array returned by parse_page.
+        """
+        n = min(len(page), self.page_size)
+        offset = index * self.page_size
+        self.timestamp[offset:offset + n] = page[:n, 0]
+        for i, c in enumerate(COLUMNS[1:]):
+            self.values[c][offset:offset + n] = page[:n, i + 1]
+        self.counts[index] = n
+
+    def frame(self, limit: int = None, closed: int = None):
+        """
+        Build the dataframe of the buffer. The candles are kept in page order, the candles which are not closed yet are
+        dropped, then the first 'limit' candles are kept and duplicated timestamps are removed.
+        :param limit: the maximum number of candles, None for no limit.
+        :param closed: the start of the candle in progress in milliseconds, the candles starting from it are dropped. If
+        None, the last candle is dropped as it is usually not closed yet.
+        :return: a dataframe with the following columns: "timestamp", "open", "high", "low", "close", "volume".
+        """
+        if (self.counts == self.page_size).all():
+            select = slice(None)
+        else:
+            select = (np.arange(self.page_size) < self.counts[:, None]).ravel()
+        ts = self.timestamp[select]
+        columns = {c: v[select] for c, v in self.values.items()}
+
+        if closed is None:
+            n = max(0, len(ts) - 1)
+        else:
+            if len(ts) and ts.max() >= closed:
+                keep = ts < closed
+                ts = ts[keep]
+                columns = {c: v[keep] for c, v in columns.items()}
+            n = len(ts)
+        if limit is not None:
+            n = min(n, limit)
+        ts = ts[:n]
+        columns = {c: v[:n] for c, v in columns.items()}
+
+        # Keep the first occurrence of each timestamp without reordering the candles
+        _, first = np.unique(ts, return_index=True)
+        if len(first) < len(ts):
+            first.sort()
+            ts = ts[first]
+            columns = {c: v[first] for c, v in columns.items()}
+        return pd.DataFrame({'timestamp': ts, **columns}, columns=COLUMNS, copy=False)
@@ -0,0 +1,124 @@
+import asyncio
+import random
+import threading
+import time
+
+# Response headers reporting the used request weight, mapped to the weight limit of their window.
+WEIGHT_HEADERS = {
+    'x-mbx-used-weight-1m': 6000,
+}
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 60):
+    """
+    Full jitter exponential back-off.
+    :param attempt: the number of failed attempts, starting at 1.
+    :param base: the back-off of the first attempt in seconds.
+    :param cap: the maximum back-off in seconds.
+    :return: a random delay in seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = None, increase: float = None,
+                 decrease: float = 0.5, weight_headers: dict = None):
+        """
+        A thread safe token bucket shared by every request of an OhlcvPlus instance. The refill rate follows an
+        additive increase / multiplicative decrease policy: each successful request raises the rate by 'increase' up
+        to 'rate', each rate limit error multiplies it by 'decrease'.
+        :param rate: the maximum number of requests per second, this is the ceiling of the exchange.
+        :param capacity: the maximum number of requests sent in a burst, default is one second of requests.
+        :param min_rate: the minimum number of requests per second, default is rate / 64.
+        :param increase: the rate increase after a successful request, default is rate / 50.
+        :param decrease: the factor applied to the rate after a rate limit error.
+        :param weight_headers: a dict of response headers reporting the used weight mapped to the weight limit, when
+        the used weight gets close to the limit the rate is decreased before the exchange rejects requests. Default is
+        WEIGHT_HEADERS.
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = capacity if capacity is not None else max(1.0, self.max_rate)
+        self.min_rate = min_rate if min_rate is not None else self.max_rate / 64
+        self.increase = increase if increase is not None else self.max_rate / 50
+        self.decrease = decrease
+        self.weight_headers = WEIGHT_HEADERS if weight_headers is None else weight_headers
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.last_penalty = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_client(cls, client):
+        """
+        Build a rate limiter from the rateLimit attribute of a ccxt client, the number of milliseconds between two
+        requests.
+        """
+        rate_limit = getattr(client, 'rateLimit', None) or 100
+        return cls(1000 / rate_limit)
+
+    @property
+    def throttled(self):
+        return self.rate < self.max_rate
+
+    def reserve(self):
+        """
+        Take a token from the bucket.
+        :return: the number of seconds to wait before sending the request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        """
+        Block until a request can be sent.
+        :return: the time waited in seconds.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def success(self, headers: dict = None):
+        """
+        Report a successful request.
+        :param headers: the response headers, used to read the used weight if the exchange reports it.
+        """
+        ratio = 0
+        if headers:
+            headers = {k.lower(): v for k, v in headers.items()}
+            for name, limit in self.weight_headers.items():
+                if name in headers:
+                    ratio = max(ratio, int(headers[name]) / limit)
+        if ratio > 0.9:
+            self.penalize()
+            return
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def penalize(self):
+        """
+        Report a rate limit error. Errors received within a second of the previous decrease are ignored as they were
+        caused by requests already in flight.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_penalty < 1:
+                return
+            self.last_penalty = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+
+    async def aacquire(self):
+        """
+        Asynchronous version of acquire.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
@@ -0,0 +1,496 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as orm
+from sqlalchemy.dialects.sqlite import insert
+
+COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# Pragmas applied to every new sqlite connection. page_size only has an effect on a new database file, it is set
+# before journal_mode because the page size of a WAL database can not be changed.
+DEFAULT_PRAGMAS = {
+    'page_size': 32768,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,  # negative values are in KiB, 64 MiB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 60000,  # milliseconds a connection waits for the lock held by another connection
+}
+
+# Number of rows sent to sqlite in a single executemany call.
+CHUNK_SIZE = 50000
+# Name of the file listing the segments of a series of NumpyStorage.
+MANIFEST = 'manifest.json'
+# Number of segments of a series of NumpyStorage above which all of them are merged into one.
+MAX_SEGMENTS = 64
+# Number of times NumpyStorage reads a window whose segments are deleted by a concurrent write.
+READ_ATTEMPTS = 3
+
+
+def apply_pragmas(engine, pragmas: dict):
+    """
+    Register the pragmas to be executed on every new connection of a sqlite engine.
+    :param engine: a sqlalchemy engine.
+    :param pragmas: a dict of pragma names and values e.g. {'journal_mode': 'WAL'}.
+    """
+    if not pragmas:
+        return
+
+    @orm.event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def bulk_upsert(conn, table_name: str, df, chunk_size: int = CHUNK_SIZE, series_id: int = None):
+    """
+    Write an ohlcv dataframe to a sqlite table. Rows are streamed from the numpy columns of the dataframe in chunks of
+    executemany calls, existing timestamps are overwritten so overlapping saves are idempotent. This function does not
+    commit, all the chunks are written in the transaction of the connection.
+    :param conn: a sqlalchemy connection.
+    :param table_name: the name of the table, the table must have a primary key on the timestamp column.
+    :param df: a dataframe with the following columns: "timestamp", "open", "high", "low", "close", "volume".
+    :param chunk_size: the number of rows sent to sqlite per executemany call.
+    :param series_id: the id of the series for a table shared by several series, its primary key is then
+    (series_id, timestamp). None for a table holding a single series.
+    :return: the number of written rows.
+    """
+    arrays = [df['timestamp'].to_numpy(dtype=np.int64)] + [df[c].to_numpy(dtype=np.float64) for c in COLUMNS[1:]]
+    columns, key = COLUMNS, "timestamp"
+    if series_id is not None:
+        arrays = [np.full(len(df), series_id, dtype=np.int64)] + arrays
+        columns, key = ['series_id'] + COLUMNS, "series_id, timestamp"
+    statement = f'INSERT INTO "{table_name}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) ' \
+                f'ON CONFLICT({key}) DO UPDATE SET ' + \
+                ", ".join(f"{c}=excluded.{c}" for c in COLUMNS[1:])
+    for start in range(0, len(df), chunk_size):
+        rows = list(zip(*(a[start:start + chunk_size].tolist() for a in arrays)))
+        conn.exec_driver_sql(statement, rows)
+    return len(df)
+
+
+def read_range(conn, table_name: str, start: int = None, end: int = None, count: int = None, series_id: int = None):
+    """
+    Read an ohlcv window from a sqlite table. The window is pushed down to sqlite as a range scan on the timestamp
+    primary key index so only the requested candles are read from disk.
+    :param conn: a sqlalchemy connection.
+    :param table_name: the name of the table.
+    :param start: the first timestamp to read in milliseconds (included). If None, the window starts with the table.
+    :param end: the last timestamp to read in milliseconds (excluded). If None, the window ends with the table.
+    :param count: the maximum number of candles to read. If None, all the candles of the window are read.
+    :param series_id: the id of the series for a table shared by several series, see bulk_upsert.
+    :return: a dataframe with the following columns: "timestamp", "open", "high", "low", "close", "volume".
+    """
+    clauses, params = [], []
+    if series_id is not None:
+        clauses.append("series_id = ?")
+        params.append(int(series_id))
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(int(start))
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(int(end))
+    statement = f'SELECT {", ".join(COLUMNS)} FROM "{table_name}"'
+    if clauses:
+        statement += " WHERE " + " AND ".join(clauses)
+    statement += " ORDER BY timestamp"
+    if count is not None:
+        statement += " LIMIT ?"
+        params.append(int(count))
+    rows = conn.exec_driver_sql(statement, tuple(params)).fetchall()
+    return to_frame(rows)
+
+
+def read_bounds(conn, table_name: str, series_id: int = None):
+    """
+    Read the first and last timestamps of a sqlite table. Each of them is a single lookup of the primary key index,
+    sqlite scans the whole table to compute MIN and MAX in the same query.
+    :param series_id: the id of the series for a table shared by several series, see bulk_upsert.
+    :return: the (first, last) timestamps, None if the table or the series is empty.
+    """
+    where, params = ("WHERE series_id = ? ", (int(series_id),) * 2) if series_id is not None else ("", ())
+    bounds = conn.exec_driver_sql(f'SELECT (SELECT timestamp FROM "{table_name}" {where}ORDER BY timestamp LIMIT 1), '
+                                  f'(SELECT timestamp FROM "{table_name}" {where}ORDER BY timestamp DESC LIMIT 1)',
+                                  params).one()
+    return None if bounds[0] is None else (bounds[0], bounds[1])
+
+
+def to_frame(rows):
+    """
+    Build an ohlcv dataframe from a list of rows.
+    :param rows: a list of (timestamp, open, high, low, close, volume) tuples.
+    :return: a dataframe with an int64 timestamp column and float64 price and volume columns.
+    """
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    return df.astype({'timestamp': np.int64, **{c: np.float64 for c in COLUMNS[1:]}})
+
+
+class Storage:
+    """
+    Base class of the storage backends. A backend stores the candles of each series under its signature, the series
+    themselves are indexed by the 'ohlcv' catalog table of the sqlite database.
+    """
+
+    def exists(self, signature: str):
+        """
+        :return: whether the backend holds a series for this signature or not.
+        """
+        raise NotImplementedError
+
+    def create(self, signature: str):
+        """
+        Create an empty series, does nothing if the series already exists.
+        """
+        raise NotImplementedError
+
+    def write(self, signature: str, df):
+        """
+        Upsert the candles of an ohlcv dataframe, existing timestamps are overwritten.
+        :return: the number of written rows.
+        """
+        raise NotImplementedError
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        """
+        Read a window of a series, see read_range for the parameters.
+        :return: a dataframe with the following columns: "timestamp", "open", "high", "low", "close", "volume".
+        """
+        raise NotImplementedError
+
+    def bounds(self, signature: str):
+        """
+        :return: the (first, last) timestamps of a series, None if the series is empty.
+        """
+        raise NotImplementedError
+
+    def clear(self, signature: str):
+        """
+        Delete every candle of a series, the series itself is kept.
+        """
+        raise NotImplementedError
+
+    def commit(self):
+        """
+        Make the writes durable, called once per save.
+        """
+        pass
+
+
+class SQLiteStorage(Storage):
+
+    def __init__(self, db, conn, metadata):
+        """
+        The historical layout, one sqlite table named after the signature per series.
+        :param db: the sqlalchemy engine.
+        :param conn: the sqlalchemy connection, shared with the catalog so a save is a single transaction.
+        :param metadata: the sqlalchemy metadata.
+        """
+        self.db = db
+        self.conn = conn
+        self.metadata = metadata
+        # Tables are never reflected, the statements are built from COLUMNS. Only the tables known to exist are cached.
+        self.tables = set()
+
+    def exists(self, signature: str):
+        # The catalog of sqlite is read through the connection, a table created by its pending transaction is found
+        if signature not in self.tables and self.conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (signature,)).first() is not None:
+            self.tables.add(signature)
+        return signature in self.tables
+
+    def create(self, signature: str):
+        if self.exists(signature):
+            return
+        table = orm.Table(signature, self.metadata,
+                          orm.Column('timestamp', orm.BigInteger, primary_key=True),
+                          orm.Column('open', orm.Float),
+                          orm.Column('high', orm.Float),
+                          orm.Column('low', orm.Float),
+                          orm.Column('close', orm.Float),
+                          orm.Column('volume', orm.Float))
+        # Only this table is created, create_all would check every table known to the metadata. It is created in the
+        # transaction of the save registering the series.
+        self.conn.execute(orm.schema.CreateTable(table, if_not_exists=True))
+        self.tables.add(signature)
+
+    def write(self, signature: str, df):
+        return bulk_upsert(self.conn, signature, df)
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        return read_range(self.conn, signature, start, end, count)
+
+    def bounds(self, signature: str):
+        return read_bounds(self.conn, signature)
+
+    def clear(self, signature: str):
+        if self.exists(signature):
+            self.conn.execute(orm.table(signature).delete())
+
+    def commit(self):
+        self.conn.commit()
+
+
+class CandleStorage(Storage):
+
+    def __init__(self, db, conn, metadata):
+        """
+        A single sqlite table holding the candles of every series, its primary key is (series_id, timestamp) and it
+        is created without rowid so the table itself is the index: the candles of a series are stored together in
+        timestamp order and a window is a single range scan. Series are numbered by the 'ohlcv_series' table. The series
+        stored by the historical layout, one table per series, are still read and written in their own table.
+        :param db: the sqlalchemy engine.
+        :param conn: the sqlalchemy connection, shared with the catalog so a save is a single transaction.
+        :param metadata: the sqlalchemy metadata.
+        """
+        self.conn = conn
+        self.legacy = SQLiteStorage(db, conn, metadata)
+        self.series = orm.Table('ohlcv_series', metadata,
+                                orm.Column('id', orm.Integer, primary_key=True),
+                                orm.Column('signature', orm.String, unique=True, nullable=False))
+        self.candles = orm.Table('ohlcv_candles', metadata,
+                                 orm.Column('series_id', orm.Integer, primary_key=True, autoincrement=False),
+                                 orm.Column('timestamp', orm.BigInteger, primary_key=True, autoincrement=False),
+                                 orm.Column('open', orm.Float),
+                                 orm.Column('high', orm.Float),
+                                 orm.Column('low', orm.Float),
+                                 orm.Column('close', orm.Float),
+                                 orm.Column('volume', orm.Float),
+                                 sqlite_with_rowid=False)
+        self.series.create(db, checkfirst=True)
+        self.candles.create(db, checkfirst=True)
+        self.ids = {}
+
+    def _id(self, signature: str):
+        """
+        :return: the id of a series, None if it is not stored in the candle table.
+        """
+        if signature not in self.ids:
+            series_id = self.conn.execute(orm.select(self.series.c.id).where(
+                self.series.c.signature == signature)).scalar()
+            if series_id is None:
+                return None
+            self.ids[signature] = series_id
+        return self.ids[signature]
+
+    def exists(self, signature: str):
+        return self._id(signature) is not None or self.legacy.exists(signature)
+
+    def create(self, signature: str):
+        if self.exists(signature):
+            return
+        # Another process can register the same series, the existing id is then used
+        self.conn.execute(insert(self.series).values(signature=signature).on_conflict_do_nothing())
+        self._id(signature)
+
+    def write(self, signature: str, df):
+        series_id = self._id(signature)
+        if series_id is None:
+            return self.legacy.write(signature, df)
+        return bulk_upsert(self.conn, 'ohlcv_candles', df, series_id=series_id)
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        series_id = self._id(signature)
+        if series_id is None:
+            return self.legacy.read(signature, start, end, count)
+        return read_range(self.conn, 'ohlcv_candles', start, end, count, series_id=series_id)
+
+    def bounds(self, signature: str):
+        series_id = self._id(signature)
+        if series_id is None:
+            return self.legacy.bounds(signature)
+        return read_bounds(self.conn, 'ohlcv_candles', series_id)
+
+    def clear(self, signature: str):
+        series_id = self._id(signature)
+        if series_id is None:
+            return self.legacy.clear(signature)
+        self.conn.execute(self.candles.delete().where(self.candles.c.series_id == series_id))
+
+    def commit(self):
+        self.conn.commit()
+
+
+class NumpyStorage(Storage):
+
+    def __init__(self, directory: str):
+        """
+        A columnar layout, one directory per series holding immutable segments and a manifest listing them. A segment
+        is a directory holding one .npy file per column, files are memory-mapped on read so loading a window does not
+        parse anything and only touches the pages of the window. A write only writes the new candles and the stored
+        candles they overlap, then swaps the manifest with a single os.replace, so readers see either every column
+        before the write or every column after it. Small trailing segments are merged as the series grows so a series
+        has about log2 of its number of candles segments.
+        :param directory: the root directory of the series, created if needed.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, signature: str, segment: str = None, column: str = None):
+        path = os.path.join(self.directory, signature)
+        if segment is not None:
+            path = os.path.join(path, segment)
+        return path if column is None else os.path.join(path, f"{column}.npy")
+
+    def _manifest(self, signature: str):
+        """
+        :return: a (segments, next) tuple, segments is the ordered list of the [name, first, last, offset, rows] of the
+        segments of a series, a segment holds the rows [offset, offset + rows) of its files, and next is the number of
+        the next segment.
+        """
+        try:
+            with open(self._path(signature, MANIFEST)) as f:
+                manifest = json.load(f)
+            return manifest['segments'], manifest['next']
+        except FileNotFoundError:
+            pass
+        # A series written before segments were introduced holds its columns in its own directory
+        if not os.path.exists(self._path(signature, column='timestamp')):
+            return [], 0
+        ts = np.load(self._path(signature, column='timestamp'), mmap_mode='r')
+        return ([['.', int(ts[0]), int(ts[-1]), 0, len(ts)]] if len(ts) else []), 0
+
+    def _columns(self, signature: str, segment: list):
+        name, _, _, offset, rows = segment
+        return {c: np.load(self._path(signature, name, c), mmap_mode='r')[offset:offset + rows] for c in COLUMNS}
+
+    @staticmethod
+    def _slice(segment: list, ts: np.ndarray, lo: int, hi: int):
+        """
+        :return: the segment holding the rows [lo, hi) of another one, ts is the timestamp column of the latter.
+        """
+        return [segment[0], int(ts[lo]), int(ts[hi - 1]), segment[3] + lo, hi - lo]
+
+    def exists(self, signature: str):
+        return os.path.isdir(self._path(signature))
+
+    def create(self, signature: str):
+        os.makedirs(self._path(signature), exist_ok=True)
+
+    def write(self, signature: str, df):
+        block = {'timestamp': df['timestamp'].to_numpy(dtype=np.int64),
+                 **{c: df[c].to_numpy(dtype=np.float64) for c in COLUMNS[1:]}}
+        if not len(block['timestamp']):
+            return 0
+        self.create(signature)
+        segments, number = self._manifest(signature)
+        first, last = int(block['timestamp'][0]), int(block['timestamp'][-1])
+        lo = sum(1 for s in segments if s[2] < first)
+        hi = sum(1 for s in segments if s[1] <= last)
+        # Only the stored candles within the new ones are rewritten, the segments they belong to are cut around them
+        head, tail, parts = [], [], []
+        for segment in segments[lo:hi]:
+            columns = self._columns(signature, segment)
+            ts = columns['timestamp']
+            i, j = int(np.searchsorted(ts, first)), int(np.searchsorted(ts, last, 'right'))
+            if i:
+                head = [self._slice(segment, ts, 0, i)]
+            if j < len(ts):
+                tail = [self._slice(segment, ts, j, len(ts))]
+            parts.append({c: columns[c][i:j] for c in COLUMNS})
+        before, after = segments[:lo] + head, tail + segments[hi:]
+        rows = len(block['timestamp']) + sum(len(part['timestamp']) for part in parts)
+        # Trailing segments are merged while the previous one is not twice as large
+        while not after and before and before[-1][4] <= 2 * rows:
+            segment = before.pop()
+            parts.insert(0, self._columns(signature, segment))
+            rows += segment[4]
+        if len(before) + len(after) >= MAX_SEGMENTS:
+            parts = [self._columns(signature, s) for s in before] + parts + [self._columns(signature, s) for s in after]
+            before, after = [], []
+        if parts:
+            old = {c: np.concatenate([part[c] for part in parts]) for c in COLUMNS}
+            # The stored candles replaced by the new ones are dropped before merging
+            keep = ~np.isin(old['timestamp'], block['timestamp'])
+            merged = {c: np.concatenate([old[c][keep], block[c]]) for c in COLUMNS}
+            order = np.argsort(merged['timestamp'], kind='stable')
+            block = {c: merged[c][order] for c in COLUMNS}
+            del old, merged, parts
+
+        name = f"{number:08d}"
+        os.makedirs(self._path(signature, name), exist_ok=True)
+        for c in COLUMNS:
+            np.save(self._path(signature, name, c), block[c])
+        ts = block['timestamp']
+        new = before + [[name, int(ts[0]), int(ts[-1]), 0, len(ts)]] + after
+        # Every column of the new segment is written before the manifest is swapped
+        tmp = self._path(signature, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'segments': new, 'next': number + 1}, f)
+        os.replace(tmp, self._path(signature, MANIFEST))
+        for segment in {s[0] for s in segments} - {s[0] for s in new}:
+            self._remove(signature, segment)
+        return len(df)
+
+    def _remove(self, signature: str, segment: str):
+        """
+        Delete the files of a segment which is no longer listed by the manifest.
+        """
+        for c in COLUMNS:
+            try:
+                os.remove(self._path(signature, segment, c))
+            except OSError:
+                # Memory-mapped files can not be deleted on windows, they are left behind
+                pass
+        if segment != '.':
+            try:
+                os.rmdir(self._path(signature, segment))
+            except OSError:
+                pass
+
+    def read(self, signature: str, start: int = None, end: int = None, count: int = None):
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                parts = self._read(signature, start, end, count)
+                break
+            except FileNotFoundError:
+                # A concurrent write deleted a segment after swapping the manifest, the new manifest is read
+                if attempt == READ_ATTEMPTS - 1:
+                    raise
+        if len(parts) == 1:
+            columns = parts[0]
+        elif parts:
+            columns = {c: np.concatenate([part[c] for part in parts]) for c in COLUMNS}
+        else:
+            columns = {'timestamp': np.empty(0, dtype=np.int64), **{c: np.empty(0) for c in COLUMNS[1:]}}
+        return pd.DataFrame(columns, copy=False)
+
+    def _read(self, signature: str, start: int, end: int, count: int):
+        """
+        :return: the list of the columns of the window in each segment overlapping it.
+        """
+        parts = []
+        rows = 0
+        for segment in self._manifest(signature)[0]:
+            if (start is not None and segment[2] < start) or (end is not None and segment[1] >= end):
+                continue
+            if count is not None and rows >= count:
+                break
+            columns = self._columns(signature, segment)
+            ts = columns['timestamp']
+            lo = 0 if start is None else int(np.searchsorted(ts, start))
+            hi = len(ts) if end is None else int(np.searchsorted(ts, end))
+            if count is not None:
+                hi = min(hi, lo + count - rows)
+            parts.append({c: columns[c][lo:hi] for c in COLUMNS})
+            rows += hi - lo
+        return parts
+
+    def bounds(self, signature: str):
+        segments = self._manifest(signature)[0]
+        return (segments[0][1], segments[-1][2]) if segments else None
+
+    def clear(self, signature: str):
+        segments, number = self._manifest(signature)
+        if not segments:
+            return
+        tmp = self._path(signature, MANIFEST + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'segments': [], 'next': number}, f)
+        os.replace(tmp, self._path(signature, MANIFEST))
+        for segment in {s[0] for s in segments}:
+            self._remove(signature, segment)
@@ -0,0 +1,206 @@
+import os
+import queue
+import threading
+import urllib.parse
+from concurrent.futures import Future
+
+import sqlalchemy as orm
+
+from ohlcv.storage import apply_pragmas
+
+# The maximum number of writes waiting for the writer thread, submitting a write blocks while the queue is full.
+QUEUE_SIZE = 256
+# The maximum number of writes committed in a single transaction.
+BATCH_SIZE = 64
+# Pragmas which can not be applied to a read-only connection.
+WRITE_PRAGMAS = ('page_size', 'journal_mode')
+
+
+def begin_immediate(engine):
+    """
+    Make the transactions of a sqlite engine take the write lock when they begin. pysqlite begins a deferred
+    transaction before the first write, a transaction which read the database first then fails with "database is
+    locked" without waiting if another connection wrote in between. The busy timeout applies to BEGIN IMMEDIATE.
+    :param engine: a sqlalchemy engine.
+    """
+
+    @orm.event.listens_for(engine, "connect")
+    def disable_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @orm.event.listens_for(engine, "begin")
+    def begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def read_only_engine(database_path: str, pragmas: dict, pool_size: int = 8):
+    """
+    Create a pool of read-only connections to a sqlite database. Each statement runs in its own transaction, so a
+    reader always sees the last committed writes and never holds a snapshot of the write-ahead log.
+    :param database_path: the path to the database file, it must exist.
+    :param pragmas: the pragmas applied to every connection, the ones changing the database file are ignored.
+    :param pool_size: the number of connections kept open.
+    :return: a sqlalchemy engine.
+    """
+    path = urllib.parse.quote(os.path.abspath(database_path))
+    engine = orm.create_engine(f'sqlite:///file:{path}?mode=ro&uri=true', echo=False, future=True,
+                               isolation_level='AUTOCOMMIT', pool_size=pool_size, max_overflow=2 * pool_size)
+    apply_pragmas(engine, {k: v for k, v in pragmas.items() if k not in WRITE_PRAGMAS})
+    return engine
+
+
+class Writer:
+
+    def __init__(self, db, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE):
+        """
+        A thread owning the only write connection of an OhlcvPlus instance. Writes are functions submitted to a bounded
+        queue, the writer runs the queued ones in a single transaction and commits them together, each of them in a
+        savepoint so a failed write is rolled back alone.
+        :param db: the sqlalchemy engine, see begin_immediate.
+        :param queue_size: the maximum number of pending writes.
+        :param batch_size: the maximum number of writes committed together.
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.conn = None
+        self.callbacks = None
+        self.batches = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self._run, name='ohlcv-writer', daemon=True)
+        self.thread.start()
+
+    @property
+    def active(self):
+        """
+        Whether the calling thread is the writer thread.
+        """
+        return threading.current_thread() is self.thread
+
+    def submit(self, operation, *args):
+        """
+        Queue a write.
+        :param operation: a function called with args by the writer thread, its statements are run on the write
+        connection and it must not commit.
+        :return: a Future resolved with the result of operation once it is committed.
+        :raise RuntimeError: if the writer is closed.
+        """
+        if not self.thread.is_alive():
+            raise RuntimeError("The writer is closed.")
+        future = Future()
+        self.queue.put((future, operation, args))
+        return future
+
+    def execute(self, operation, *args):
+        """
+        Run a write and wait for its commit, see submit. A write submitted by a write is run in the same transaction.
+        :return: the result of operation.
+        :raise Exception: the exception raised by operation or by the commit.
+        """
+        if self.active:
+            return operation(*args)
+        return self.submit(operation, *args).result()
+
+    def after_commit(self, callback):
+        """
+        Run a function once the write being run by the writer thread is committed, it is dropped if the write is rolled
+        back. Called outside of a write, the function is run at once.
+        :param callback: a function without arguments.
+        """
+        if not self.active or self.callbacks is None:
+            callback()
+            return
+        self.callbacks.append(callback)
+
+    def close(self):
+        """
+        Commit the pending writes and stop the writer thread.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def _run(self):
+        with self.db.connect() as conn:
+            self.conn = conn
+            while True:
+                batch = [self.queue.get()]
+                while batch[-1] is not None and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is None
+                if stop:
+                    batch.pop()
+                if batch:
+                    self._commit(conn, batch)
+                if stop:
+                    return
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            with conn.begin():
+                for future, operation, args in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    # The callbacks registered by the write, run once the batch is committed
+                    callbacks = self.callbacks = []
+                    try:
+                        with conn.begin_nested():
+                            result = operation(*args)
+                        results.append((future, result, None, callbacks))
+                    except Exception as e:
+                        results.append((future, None, e, []))
+                    finally:
+                        self.callbacks = None
+        except Exception as e:
+            # The commit failed, none of the writes of the batch is stored
+            for future, _, _ in batch:
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(results)
+        for future, result, error, callbacks in results:
+            for callback in callbacks:
+                callback()
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+class RoutedConnection:
+
+    def __init__(self, reader, writer: Writer):
+        """
+        The connection of an OhlcvPlus instance in concurrent mode. Statements run by the writer thread use its write
+        connection, statements run by any other thread use a connection of the read-only pool, so any number of threads
+        can read while a write is in progress. Commits are made by the writer, commit is a no-op.
+        :param reader: the read-only engine, see read_only_engine.
+        :param writer: the Writer of the instance.
+        """
+        self.reader = reader
+        self.writer = writer
+
+    def execute(self, statement, *args, **kwargs):
+        if self.writer.active:
+            return self.writer.conn.execute(statement, *args, **kwargs)
+        with self.reader.connect() as conn:
+            # The rows are buffered so the connection goes back to the pool at once
+            return conn.execute(statement, *args, **kwargs).freeze()()
+
+    def exec_driver_sql(self, statement, *args, **kwargs):
+        if self.writer.active:
+            return self.writer.conn.exec_driver_sql(statement, *args, **kwargs)
+        with self.reader.connect() as conn:
+            return conn.exec_driver_sql(statement, *args, **kwargs).freeze()()
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.writer.close()
+        self.reader.dispose()
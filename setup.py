@@ -13,4 +13,4 @@ setup(name='ohlcv-plus',
       url='https://github.com/Shaft-3796/OHLCV-Plus',
       download_url='https://github.com/Shaft-3796/OHLCV-Plus/archive/refs/tags/2.0.0.tar.gz',
       packages=['ohlcv'],
-      install_requires=['ccxt', 'pandas', 'colorama', 'SQLAlchemy'])
\ No newline at end of file
+      install_requires=['ccxt', 'numpy', 'pandas', 'colorama', 'SQLAlchemy'])
\ No newline at end of file
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from benchmarks.fake_exchange import FakeExchange
+from ohlcv import OhlcvPlus
+from ohlcv.utils import timestamp_to_date
+
+MINUTE = 60 * 1000
+
+
+@pytest.fixture(params=['candles', 'sqlite', 'numpy'])
+def client(request, tmp_path):
+    exchange = FakeExchange(candles=20000, page_size=500)
+    ohlcv = OhlcvPlus(exchange, database_path=str(tmp_path / 'ohlcv.db'), storage=request.param)
+    yield exchange, ohlcv
+    ohlcv.close()
+
+
+def load(ohlcv, start, end):
+    return ohlcv.load('BTC/USDT', '1m', timestamp_to_date(start), timestamp_to_date(end), verbose=False)
+
+
+def assert_window(df, start, end):
+    assert np.array_equal(df['timestamp'].to_numpy(), np.arange(start, end, MINUTE))
+
+
+def test_overlapping_windows(client):
+    exchange, ohlcv = client
+    start = exchange.start
+    load(ohlcv, start, start + 1000 * MINUTE)
+    calls = exchange.calls
+    df = load(ohlcv, start + 500 * MINUTE, start + 1500 * MINUTE)
+    assert_window(df, start + 500 * MINUTE, start + 1500 * MINUTE)
+    # Only the part following the stored window is downloaded
+    assert exchange.calls - calls <= 2
+    calls = exchange.calls
+    assert_window(load(ohlcv, start, start + 1500 * MINUTE), start, start + 1500 * MINUTE)
+    assert exchange.calls == calls
+
+
+def test_extending_windows(client):
+    exchange, ohlcv = client
+    start = exchange.start
+    load(ohlcv, start + 1000 * MINUTE, start + 2000 * MINUTE)
+    df = load(ohlcv, start, start + 3000 * MINUTE)
+    assert_window(df, start, start + 3000 * MINUTE)
+    signature = ohlcv._signature('BTC/USDT', '1m')
+    assert ohlcv._intervals(signature, '1m') == [(start, start + 3000 * MINUTE)]
+    calls = exchange.calls
+    assert_window(load(ohlcv, start, start + 3000 * MINUTE), start, start + 3000 * MINUTE)
+    assert exchange.calls == calls
+
+
+def test_disjoint_windows(client):
+    exchange, ohlcv = client
+    start = exchange.start
+    load(ohlcv, start, start + 1000 * MINUTE)
+    calls = exchange.calls
+    df = load(ohlcv, start + 15000 * MINUTE, start + 16000 * MINUTE)
+    assert_window(df, start + 15000 * MINUTE, start + 16000 * MINUTE)
+    # The candles between the two windows are not downloaded
+    assert exchange.calls - calls <= 3
+    signature = ohlcv._signature('BTC/USDT', '1m')
+    assert len(ohlcv._intervals(signature, '1m')) == 2
+    assert ohlcv.storage.read(signature, start + 1000 * MINUTE, start + 15000 * MINUTE).empty
+    calls = exchange.calls
+    assert_window(load(ohlcv, start + 15000 * MINUTE, start + 16000 * MINUTE), start + 15000 * MINUTE,
+                  start + 16000 * MINUTE)
+    assert exchange.calls == calls
+    # Loading a window spanning both only downloads the candles between them
+    assert_window(load(ohlcv, start + 500 * MINUTE, start + 15500 * MINUTE), start + 500 * MINUTE,
+                  start + 15500 * MINUTE)
+    assert len(ohlcv._intervals(signature, '1m')) == 1
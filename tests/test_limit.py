@@ -0,0 +1,30 @@
+import pytest
+
+from benchmarks.fake_exchange import FakeExchange
+from ohlcv import OhlcvPlus
+from ohlcv.utils import timestamp_to_date
+
+HOUR = 60 * 60 * 1000
+
+
+@pytest.mark.parametrize('limit', [500, 999, 1000, 1001])
+def test_count_limit(tmp_path, limit):
+    exchange = FakeExchange(candles=20000, page_size=500)
+    ohlcv = OhlcvPlus(exchange, database_path=str(tmp_path / 'ohlcv.db'))
+    since = timestamp_to_date(exchange.start)
+    assert len(ohlcv.load('BTC/USDT', '1m', since, limit, verbose=False)) == limit
+    calls = exchange.calls
+    # The stored series covers the whole window, nothing is downloaded again
+    assert len(ohlcv.load('BTC/USDT', '1m', since, limit, verbose=False)) == limit
+    assert exchange.calls == calls
+    ohlcv.close()
+
+
+def test_candle_in_progress(tmp_path):
+    exchange = FakeExchange(candles=2000, timeframe='1h', page_size=500)
+    ohlcv = OhlcvPlus(exchange, database_path=str(tmp_path / 'ohlcv.db'))
+    df = ohlcv.load('BTC/USDT', '1h', timestamp_to_date(exchange.start), -1, verbose=False)
+    # The exchange serves the candle in progress at exchange.end, it is not returned
+    assert len(df) == 2000
+    assert df['timestamp'].iloc[-1] == exchange.end - HOUR
+    ohlcv.close()